@@ -1,4 +1,15 @@
 import argparse
+import io
+import mmap
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from multiprocessing import Pool
 
 def rotation(T):
     '''
@@ -21,11 +32,205 @@ def bwm(T):
     '''
     return sorted(rotation(T))
 
+def rankText(T):
+    '''
+    return T as a list of integer ranks of its characters and the largest rank
+    '''
+    alphabet = sorted(set(T))
+    rank = {char: i for i, char in enumerate(alphabet)}
+    return [rank[char] for char in T], len(alphabet) - 1
+
+def sais(s, upper):
+    '''
+    suffix array of integer list s with values in [0, upper] by SA-IS
+    the end of s is treated as a virtual sentinel smaller than every value
+    referred to the induced sorting of Nong, Zhang and Chan (2009) as laid out in AtCoder Library
+    '''
+    n = len(s)
+    if n == 0:
+        return []
+    if n == 1:
+        return [0]
+    if n == 2:
+        return [0, 1] if s[0] < s[1] else [1, 0]
+
+    sa = [0] * n
+    # ls[i] is True if suffix i is S-type (smaller than suffix i+1)
+    ls = [False] * n
+    for i in range(n - 2, -1, -1):
+        ls[i] = ls[i + 1] if s[i] == s[i + 1] else s[i] < s[i + 1]
+
+    # bucket boundaries for L-type and S-type suffixes of each character
+    sum_l = [0] * (upper + 1)
+    sum_s = [0] * (upper + 1)
+    for i in range(n):
+        if not ls[i]:
+            sum_s[s[i]] += 1
+        else:
+            sum_l[s[i] + 1] += 1
+    for i in range(upper + 1):
+        sum_s[i] += sum_l[i]
+        if i < upper:
+            sum_l[i + 1] += sum_s[i]
+
+    def induce(lms):
+        for i in range(n):
+            sa[i] = -1
+        # put lms suffixes at the start of their S buckets
+        buf = sum_s[:]
+        for d in lms:
+            if d == n:
+                continue
+            sa[buf[s[d]]] = d
+            buf[s[d]] += 1
+        # induce L-type suffixes from left to right
+        buf = sum_l[:]
+        sa[buf[s[n - 1]]] = n - 1
+        buf[s[n - 1]] += 1
+        for i in range(n):
+            v = sa[i]
+            if v >= 1 and not ls[v - 1]:
+                sa[buf[s[v - 1]]] = v - 1
+                buf[s[v - 1]] += 1
+        # induce S-type suffixes from right to left
+        buf = sum_l[:]
+        for i in range(n - 1, -1, -1):
+            v = sa[i]
+            if v >= 1 and ls[v - 1]:
+                buf[s[v - 1] + 1] -= 1
+                sa[buf[s[v - 1] + 1]] = v - 1
+
+    # number the lms positions from left to right
+    lms_map = [-1] * (n + 1)
+    lms = []
+    for i in range(1, n):
+        if not ls[i - 1] and ls[i]:
+            lms_map[i] = len(lms)
+            lms.append(i)
+    m = len(lms)
+
+    induce(lms)
+
+    if m:
+        # name lms substrings in their induced order and sort them recursively
+        sorted_lms = [v for v in sa if lms_map[v] != -1]
+        rec_s = [0] * m
+        rec_upper = 0
+        rec_s[lms_map[sorted_lms[0]]] = 0
+        for i in range(1, m):
+            l = sorted_lms[i - 1]
+            r = sorted_lms[i]
+            end_l = lms[lms_map[l] + 1] if lms_map[l] + 1 < m else n
+            end_r = lms[lms_map[r] + 1] if lms_map[r] + 1 < m else n
+            same = True
+            if end_l - l != end_r - r:
+                same = False
+            else:
+                while l < end_l:
+                    if s[l] != s[r]:
+                        break
+                    l += 1
+                    r += 1
+                if l == n or s[l] != s[r]:
+                    same = False
+            if not same:
+                rec_upper += 1
+            rec_s[lms_map[sorted_lms[i]]] = rec_upper
+
+        rec_sa = sais(rec_s, rec_upper)
+        for i in range(m):
+            sorted_lms[i] = lms[rec_sa[i]]
+        induce(sorted_lms)
+
+    return sa
+
+def rotationArray(s, upper):
+    '''
+    return start indices of the sorted rotations of integer list s by prefix doubling
+    used when the text is not terminated by a unique smallest sentinel
+    '''
+    n = len(s)
+    if n == 0:
+        return array('l')
+
+    # initial order and classes by counting sort on single characters
+    cnt = [0] * max(upper + 1, n)
+    for x in s:
+        cnt[x] += 1
+    for i in range(1, upper + 1):
+        cnt[i] += cnt[i - 1]
+    p = array('l', [0]) * n
+    for i in range(n - 1, -1, -1):
+        cnt[s[i]] -= 1
+        p[cnt[s[i]]] = i
+    c = array('l', [0]) * n
+    classes = 1
+    for i in range(1, n):
+        if s[p[i]] != s[p[i - 1]]:
+            classes += 1
+        c[p[i]] = classes - 1
+
+    h = 1
+    pn = array('l', [0]) * n
+    cn = array('l', [0]) * n
+    while h < n and classes < n:
+        # rotations sorted by their second half are the first order shifted back by h
+        for i in range(n):
+            pn[i] = p[i] - h if p[i] >= h else p[i] - h + n
+        # stable counting sort by the class of the first half
+        for i in range(classes):
+            cnt[i] = 0
+        for i in range(n):
+            cnt[c[pn[i]]] += 1
+        for i in range(1, classes):
+            cnt[i] += cnt[i - 1]
+        for i in range(n - 1, -1, -1):
+            cnt[c[pn[i]]] -= 1
+            p[cnt[c[pn[i]]]] = pn[i]
+        # recompute classes of rotations of length 2h
+        cn[p[0]] = 0
+        classes = 1
+        for i in range(1, n):
+            if c[p[i]] != c[p[i - 1]] or c[(p[i] + h) % n] != c[(p[i - 1] + h) % n]:
+                classes += 1
+            cn[p[i]] = classes - 1
+        c, cn = cn, c
+        h <<= 1
+
+    return p
+
+def suffixArray(T):
+    '''
+    return suffix array of T as a compact integer array
+    '''
+    s, upper = rankText(T)
+    return array('l', sais(s, upper))
+
+def sortedRotations(T):
+    '''
+    return start indices of the rows of bwm(T) without building the rotation matrix
+    '''
+    if not T:
+        return []
+
+    s, upper = rankText(T)
+    # if T ends with a unique smallest sentinel, sorting suffixes equals sorting rotations
+    if s[-1] == 0 and s.count(0) == 1:
+        return sais(s, upper)
+    # otherwise sort the rotations themselves
+    return rotationArray(s, upper)
+
+def bwtString(T):
+    '''
+    return burrows-wheeler transform of T without building the rotation matrix
+    '''
+    return ''.join([T[i - 1] for i in sortedRotations(T)])
+
 def runLengthEncoding(T):
     '''
     return run length encoding of T
     '''
-    ret_str = ""
+    ret = []
     pre_char = ""
     cnt = 0
     
@@ -38,7 +243,7 @@ def runLengthEncoding(T):
         # if current character is changed
         elif T[i] != pre_char:
             # put the counter and corresponding character to return string
-            ret_str = ret_str + str(cnt) + pre_char
+            ret.append(str(cnt) + pre_char)
             # initialize counter
             cnt = 1
             pre_char = T[i]
@@ -48,16 +253,182 @@ def runLengthEncoding(T):
             cnt += 1
         # last poistion
         if i == (len(T) - 1):
-            ret_str = ret_str + str(cnt) + pre_char
+            ret.append(str(cnt) + pre_char)
     
-    return ret_str
+    return ''.join(ret)
     
+# binary run length format: magic, flag byte, then (symbol byte, varint run length) records
+# optionally symbols are move-to-front coded and the records are huffman coded by zlib
+RLE_MAGIC = b'BWR1'
+RLE_FLAG_MTF = 1
+RLE_FLAG_ENTROPY = 2
+CHUNK_SIZE = 1 << 16
+# maximal runs of a repeated byte
+RUN_PATTERN = re.compile(rb'(.)\1*', re.S)
+
+def encodeVarint(n):
+    '''
+    return n as little-endian base-128 varint bytes
+    '''
+    ret = bytearray()
+    while n >= 0x80:
+        ret.append((n & 0x7f) | 0x80)
+        n >>= 7
+    ret.append(n)
+    return bytes(ret)
+
+def decodeVarint(buf, pos):
+    '''
+    return the varint starting at buf[pos] and the position after it, or None if it is incomplete
+    '''
+    ret = 0
+    shift = 0
+    while pos < len(buf):
+        byte = buf[pos]
+        pos += 1
+        ret |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return ret, pos
+        shift += 7
+    return None
+
+def binaryRunLengthEncoding(infile, outfile, mtf=False, entropy=False, chunk_size=CHUNK_SIZE):
+    '''
+    read bytes from infile in chunks and write their binary run length encoding to outfile
+    '''
+    flags = (RLE_FLAG_MTF if mtf else 0) | (RLE_FLAG_ENTROPY if entropy else 0)
+    outfile.write(RLE_MAGIC + bytes([flags]))
+
+    if entropy:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_HUFFMAN_ONLY)
+        def write(data):
+            outfile.write(compressor.compress(data))
+    else:
+        write = outfile.write
+
+    table = list(range(256))
+    buf = bytearray()
+    pre_char = -1
+    cnt = 0
+
+    def putRun(char, cnt):
+        if mtf:
+            idx = table.index(char)
+            del table[idx]
+            table.insert(0, char)
+            char = idx
+        buf.append(char)
+        buf.extend(encodeVarint(cnt))
+
+    while True:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            break
+        for match in RUN_PATTERN.finditer(chunk):
+            char = chunk[match.start()]
+            length = match.end() - match.start()
+            # a run may continue across the chunk boundary
+            if char == pre_char:
+                cnt += length
+                continue
+            if cnt:
+                putRun(pre_char, cnt)
+            pre_char = char
+            cnt = length
+        if len(buf) >= chunk_size:
+            write(bytes(buf))
+            buf.clear()
+
+    if cnt:
+        putRun(pre_char, cnt)
+    write(bytes(buf))
+    if entropy:
+        outfile.write(compressor.flush())
+
+def binaryRunLengthDecoding(infile, outfile, chunk_size=CHUNK_SIZE):
+    '''
+    read binary run length encoding from infile in chunks and write the decoded bytes to outfile
+    '''
+    header = infile.read(len(RLE_MAGIC) + 1)
+    assert header[:len(RLE_MAGIC)] == RLE_MAGIC, "Input is not in binary run length format."
+    flags = header[-1]
+    mtf = flags & RLE_FLAG_MTF
+    entropy = flags & RLE_FLAG_ENTROPY
+
+    if entropy:
+        decompressor = zlib.decompressobj(-15)
+        def read():
+            # bound the inflated size of each chunk by reusing the unconsumed input first
+            while True:
+                data = decompressor.unconsumed_tail or infile.read(chunk_size)
+                if not data:
+                    return decompressor.flush()
+                out = decompressor.decompress(data, chunk_size)
+                if out:
+                    return out
+    else:
+        def read():
+            return infile.read(chunk_size)
+
+    table = list(range(256))
+    pending = b''
+    out = bytearray()
+
+    while True:
+        chunk = read()
+        if not chunk:
+            break
+        buf = pending + chunk
+        pos = 0
+        while pos < len(buf):
+            # keep a record whose varint is cut by the chunk boundary for the next chunk
+            record = decodeVarint(buf, pos + 1)
+            if record is None:
+                break
+            char = buf[pos]
+            cnt, pos = record
+            if mtf:
+                char = table.pop(char)
+                table.insert(0, char)
+            # long runs are written in pieces to keep memory bounded
+            while cnt > 0:
+                piece = min(cnt, chunk_size)
+                out.extend(bytes([char]) * piece)
+                cnt -= piece
+                if len(out) >= chunk_size:
+                    outfile.write(bytes(out))
+                    out.clear()
+        pending = buf[pos:]
+
+    assert not pending, "Binary run length input is truncated."
+    outfile.write(bytes(out))
+
 def bwtEncoding(T):
     '''
     burrows-wheeler transform encoding
     return list of last character of each element in bwm
     '''
-    return runLengthEncoding(''.join([x[-1] for x in bwm(T)]))
+    return runLengthEncoding(bwtString(T))
+
+def isaCheckpoints(sa, step):
+    '''
+    return rows of bwm whose rotation starts at text positions 0, step, 2*step, ...
+    these inverse suffix array samples let the text be inverted segment by segment
+    '''
+    ret = array('l', [0]) * ((len(sa) + step - 1) // step)
+    for row in range(len(sa)):
+        if sa[row] % step == 0:
+            ret[sa[row] // step] = row
+    return ret
+
+def bwtEncodingWithCheckpoints(T, step):
+    '''
+    burrows-wheeler transform encoding together with inverse suffix array checkpoints
+    return run length encoded bwt and checkpoint rows every step text positions
+    '''
+    sa = sortedRotations(T)
+    bwt = ''.join([T[i - 1] for i in sa])
+    return runLengthEncoding(bwt), isaCheckpoints(sa, step)
 
 # referred to youtube video (https://www.youtube.com/watch?v=4n7NPk5lwbI) and its python code (https://nbviewer.jupyter.org/github/BenLangmead/comp-genomics-class/blob/master/notebooks/CG_BWT_SimpleBuild.ipynb)
 
@@ -66,7 +437,7 @@ def runLengthDecoding(T):
     return run length decoding of T
     '''
     cnt = ""
-    ret = ""
+    ret = []
     
     for i in range(len(T)):
         # collect number characters
@@ -74,10 +445,10 @@ def runLengthDecoding(T):
             cnt = cnt + T[i]
         # encounter character
         else:
-            ret = ret + int(cnt) * T[i]
+            ret.append(int(cnt) * T[i])
             cnt = ""
     
-    return ret     
+    return ''.join(ret)
 
 def carray(bwt):
     '''
@@ -108,69 +479,650 @@ def LF(bwt):
     '''
 
     carr = carray(bwt)
-    cnt_dict = {} # count occurrence of each element 
-    for key in carr.keys():
-        cnt_dict[key] = 0
+    # next row to be assigned to each character, starting from its c-array entry
+    next_row = dict(carr)
     
-    ret_lf = []
-    for i in range(len(bwt)):
-        char = bwt[i]
+    ret_lf = array('l', [0]) * len(bwt)
+    for i, char in enumerate(bwt):
         # calculate lf using carray and curent counter of each character
-        ret_lf.append(carr[char] + cnt_dict[char])
-        cnt_dict[char] += 1
+        ret_lf[i] = next_row[char]
+        next_row[char] += 1
     
     return ret_lf
 
-def bwtDecoding(T):
+def invertSegment(bwt, lf, row, length):
+    '''
+    return the length characters of text preceding the rotation at row
+    the output buffer is preallocated and filled back-to-front by following lf
+    '''
+    ret = bytearray(length) if isinstance(bwt, bytes) else [''] * length
+    for k in range(length - 1, -1, -1):
+        ret[k] = bwt[row]
+        row = lf[row]
+    return ret
+
+# bwt and lf shared with inversion workers, set by initInversionWorker
+_inversion_bwt = None
+_inversion_lf = None
+
+def initInversionWorker(bwt, lf):
+    global _inversion_bwt, _inversion_lf
+    _inversion_bwt = bwt
+    _inversion_lf = lf
+
+def invertSegmentWorker(task):
+    row, length = task
+    return invertSegment(_inversion_bwt, _inversion_lf, row, length)
+
+def bwtDecoding(T, checkpoints=None, step=None, workers=1):
     '''
     burrows-wheeler transform decoding
+    with checkpoints and step from bwtEncodingWithCheckpoints, segments are inverted by a pool of workers
     '''
     # convert run legnth encoded form to bwt
-    bwt = runLengthDecoding(T)
+    return bwtInversion(runLengthDecoding(T), checkpoints, step, workers)
+
+def bwtInversion(bwt, checkpoints=None, step=None, workers=1):
+    '''
+    return the text whose burrows-wheeler transform is bwt
+    '''
+    n = len(bwt)
+    if n == 0:
+        return ""
     
     lf = LF(bwt)
-    
-    # initialize return string to $ and index to 0
-    ret = '$'
-    curr_idx = 0
-    
-    while True:
-        curr_char = bwt[curr_idx]
-        # if encounter sentinel, finish the run
-        if curr_char == '$':
-            break
-        
-        else:
-            ret = curr_char + ret
-            # reset the idx using lf
-            curr_idx = lf[curr_idx]
-            
-    return ret
+    # the row ending with the sentinel is the rotation starting at text position 0
+    last_row = bwt.index('$')
+    # keep ascii text as bytes so the output buffer can be a bytearray
+    is_ascii = bwt.isascii()
+    if is_ascii:
+        bwt = bwt.encode('ascii')
+
+    # following lf from the rotation starting at position p recovers the text before p
+    if checkpoints is None:
+        segments = [(last_row, n)]
+    else:
+        # segment j covers text positions j*step to (j+1)*step, inverted from the checkpoint of its end
+        segments = []
+        for j in range(len(checkpoints)):
+            end = min((j + 1) * step, n)
+            row = checkpoints[j + 1] if j + 1 < len(checkpoints) else checkpoints[0]
+            segments.append((row, end - j * step))
+
+    if workers > 1 and len(segments) > 1:
+        with Pool(workers, initializer=initInversionWorker, initargs=(bwt, lf)) as pool:
+            parts = pool.map(invertSegmentWorker, segments)
+    else:
+        parts = [invertSegment(bwt, lf, row, length) for row, length in segments]
+
+    if is_ascii:
+        return b''.join(parts).decode('ascii')
+    return ''.join([''.join(part) for part in parts])
+
+# block container: header, one frame per block, index of frame offsets and a footer
+# header is magic and block size, a frame is (eof row, block length, payload length) and its
+# binary run length payload, and the footer is (index offset, number of blocks) and magic
+BLOCK_MAGIC = b'BWB1'
+BLOCK_HEADER = struct.Struct('<4sI')
+BLOCK_FRAME = struct.Struct('<III')
+BLOCK_FOOTER = struct.Struct('<QI4s')
+BLOCK_SIZE = 1 << 20
+
+def blockBwt(block):
+    '''
+    return the row of the virtual end-of-block sentinel and the bwt of block without it
+    '''
+    # shift bytes up by one so that 0 can serve as the sentinel
+    s = [x + 1 for x in block]
+    s.append(0)
+    sa = sais(s, 256)
+    return sa.index(0), bytes([block[p - 1] for p in sa if p])
+
+def blockInversion(eof_row, bwt):
+    '''
+    return the block whose bwt without its sentinel row eof_row is bwt
+    '''
+    n = len(bwt)
+    # put a placeholder back at the sentinel row, it is never read during inversion
+    full = bwt[:eof_row] + b'\0' + bwt[eof_row:]
+
+    # c-array counts the sentinel before every byte value
+    counts = Counter(bwt)
+    next_row = [0] * 256
+    cum = 1
+    for char in range(256):
+        next_row[char] = cum
+        cum += counts[char]
+
+    lf = array('l', [0]) * (n + 1)
+    for row, char in enumerate(full):
+        if row != eof_row:
+            lf[row] = next_row[char]
+            next_row[char] += 1
+
+    # row 0 is the sentinel rotation, so its last character is the last byte of the block
+    return bytes(invertSegment(full, lf, 0, n))
+
+def encodeBlock(task):
+    '''
+    return the container frame of one block
+    '''
+    block, mtf, entropy = task
+    eof_row, bwt = blockBwt(block)
+    payload = io.BytesIO()
+    binaryRunLengthEncoding(io.BytesIO(bwt), payload, mtf, entropy)
+    payload = payload.getvalue()
+    return BLOCK_FRAME.pack(eof_row, len(block), len(payload)) + payload
+
+def decodeBlock(frame):
+    '''
+    return the block stored in one container frame
+    '''
+    eof_row, length, payload_length = BLOCK_FRAME.unpack_from(frame)
+    bwt = io.BytesIO()
+    binaryRunLengthDecoding(io.BytesIO(frame[BLOCK_FRAME.size:]), bwt)
+    bwt = bwt.getvalue()
+    assert len(bwt) == length, "Block length does not match its frame."
+    return blockInversion(eof_row, bwt)
+
+def mapBlocks(func, tasks, workers):
+    '''
+    yield func of each task in order, using a pool of workers on batches of tasks
+    batches keep only a few blocks per worker in memory at once
+    '''
+    if workers <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+
+    with Pool(workers) as pool:
+        batch = []
+        for task in tasks:
+            batch.append(task)
+            if len(batch) == 2 * workers:
+                yield from pool.map(func, batch)
+                batch = []
+        if batch:
+            yield from pool.map(func, batch)
+
+def blockEncoding(infile, outfile, block_size=BLOCK_SIZE, workers=1, mtf=False, entropy=False):
+    '''
+    split bytes from infile into blocks, bwt and run length encode each and write the container to outfile
+    '''
+    def blocks():
+        while True:
+            block = infile.read(block_size)
+            if not block:
+                return
+            yield block, mtf, entropy
+
+    outfile.write(BLOCK_HEADER.pack(BLOCK_MAGIC, block_size))
+    offset = BLOCK_HEADER.size
+    offsets = array('Q')
+    for frame in mapBlocks(encodeBlock, blocks(), workers):
+        offsets.append(offset)
+        outfile.write(frame)
+        offset += len(frame)
+
+    outfile.write(offsets.tobytes())
+    outfile.write(BLOCK_FOOTER.pack(offset, len(offsets), BLOCK_MAGIC))
+
+def readBlockIndex(infile):
+    '''
+    return block size and frame offsets of the container in seekable infile
+    '''
+    infile.seek(0)
+    magic, block_size = BLOCK_HEADER.unpack(infile.read(BLOCK_HEADER.size))
+    assert magic == BLOCK_MAGIC, "Input is not a block container."
+    infile.seek(-BLOCK_FOOTER.size, io.SEEK_END)
+    index_offset, nblocks, magic = BLOCK_FOOTER.unpack(infile.read(BLOCK_FOOTER.size))
+    assert magic == BLOCK_MAGIC, "Block container is truncated."
+    infile.seek(index_offset)
+    offsets = array('Q')
+    offsets.frombytes(infile.read(nblocks * offsets.itemsize))
+    return block_size, offsets
+
+def readFrame(infile, offset):
+    '''
+    return the frame starting at offset of infile
+    '''
+    infile.seek(offset)
+    header = infile.read(BLOCK_FRAME.size)
+    payload_length = BLOCK_FRAME.unpack(header)[2]
+    return header + infile.read(payload_length)
+
+def blockDecoding(infile, outfile, workers=1):
+    '''
+    decode every block of the container in seekable infile and write them to outfile
+    '''
+    block_size, offsets = readBlockIndex(infile)
+    frames = (readFrame(infile, offset) for offset in offsets)
+    for block in mapBlocks(decodeBlock, frames, workers):
+        outfile.write(block)
+
+def blockAt(infile, i):
+    '''
+    return block i of the container in seekable infile without decoding the others
+    '''
+    block_size, offsets = readBlockIndex(infile)
+    return decodeBlock(readFrame(infile, offsets[i]))
+
+# on-disk FM-index: header, alphabet, then int64 c-array, occurrence checkpoints, suffix array
+# rank checkpoints and samples, then the bwt and suffix array marks as one byte per row
+FM_MAGIC = b'BWTFMIDX'
+FM_VERSION = 1
+FM_HEADER = struct.Struct('<8sIQIIIQ')
+
+class FMIndex:
+    '''
+    FM-index over the BWT of a text for counting and locating patterns by backward search.
+    occurrence counts are kept only every occ_rate rows and suffix array values only for
+    text positions divisible by sa_rate, so both rates trade query time for memory.
+    the bwt and marks are byte views and the tables are int64 arrays, so an index saved
+    with save() can be memory-mapped by load() and queried without being parsed.
+    '''
+    def __init__(self, T, occ_rate=32, sa_rate=32):
+        # the index needs a unique sentinel at the end of the text, which may sort after other characters
+        if not T.endswith('$'):
+            T = T + '$'
+        assert T.count('$') == 1, "Text should contain '$' only as its last character."
+        assert T.isascii(), "Text should consist of ascii characters."
+
+        self.occ_rate = occ_rate
+        self.sa_rate = sa_rate
+
+        s, upper = rankText(T)
+        sa = sais(s, upper)
+        del s
+
+        self.n = len(T)
+        text = T.encode('ascii')
+        bwt = bytes([text[i - 1] for i in sa])
+        del text
+        self.bwt = memoryview(bwt)
+        self.carr = carray(bwt)
+
+        # occurrence checkpoints: occ[char][k] is the count of char in bwt[0:k * occ_rate]
+        self.occ = {}
+        for char in self.carr.keys():
+            checkpoints = array('q', [0])
+            cnt = 0
+            for start in range(0, self.n, occ_rate):
+                cnt += bwt.count(char, start, start + occ_rate)
+                checkpoints.append(cnt)
+            self.occ[char] = checkpoints
+
+        # suffix array samples in row order, marked rows and rank checkpoints of the marks
+        sa_marks = bytearray(self.n)
+        self.sa_samples = array('q')
+        for row in range(self.n):
+            if sa[row] % sa_rate == 0:
+                sa_marks[row] = 1
+                self.sa_samples.append(sa[row])
+        self.sa_rank = array('q', [0])
+        cnt = 0
+        for start in range(0, self.n, occ_rate):
+            cnt += sa_marks.count(1, start, start + occ_rate)
+            self.sa_rank.append(cnt)
+        self.sa_marks = memoryview(sa_marks)
+
+    def save(self, path):
+        '''
+        write the index to path in the on-disk format read by load()
+        '''
+        alphabet = sorted(self.carr.keys())
+        with open(path, 'wb') as f:
+            f.write(FM_HEADER.pack(FM_MAGIC, FM_VERSION, self.n, self.occ_rate, self.sa_rate,
+                                   len(alphabet), len(self.sa_samples)))
+            # pad the alphabet so the int64 tables stay 8-byte aligned
+            f.write(bytes(alphabet).ljust((len(alphabet) + 7) // 8 * 8, b'\0'))
+            f.write(array('q', [self.carr[char] for char in alphabet]).tobytes())
+            for char in alphabet:
+                f.write(array('q', self.occ[char]).tobytes())
+            f.write(array('q', self.sa_rank).tobytes())
+            f.write(array('q', self.sa_samples).tobytes())
+            f.write(self.bwt)
+            f.write(self.sa_marks)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        return the index saved at path, backed by a read-only memory map of the file
+        '''
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, occ_rate, sa_rate, sigma, nsamples = FM_HEADER.unpack_from(mm)
+        assert magic == FM_MAGIC, "File is not an FM-index."
+        assert version == FM_VERSION, "FM-index version " + str(version) + " is not supported."
+
+        ret = cls.__new__(cls)
+        ret.n = n
+        ret.occ_rate = occ_rate
+        ret.sa_rate = sa_rate
+        view = memoryview(mm)
+        pos = FM_HEADER.size
+
+        def take(length, fmt='B'):
+            nonlocal pos
+            region = view[pos:pos + length]
+            pos += length
+            return region.cast(fmt) if fmt != 'B' else region
+
+        alphabet = bytes(take((sigma + 7) // 8 * 8)[:sigma])
+        ret.carr = dict(zip(alphabet, take(8 * sigma, 'q')))
+        nblocks = (n + occ_rate - 1) // occ_rate + 1
+        ret.occ = {char: take(8 * nblocks, 'q') for char in alphabet}
+        ret.sa_rank = take(8 * nblocks, 'q')
+        ret.sa_samples = take(8 * nsamples, 'q')
+        ret.bwt = take(n)
+        ret.sa_marks = take(n)
+        return ret
+
+    def rank(self, char, i):
+        '''
+        return the number of occurrences of char in bwt[0:i]
+        '''
+        if char not in self.occ:
+            return 0
+        block = i // self.occ_rate
+        start = block * self.occ_rate
+        return self.occ[char][block] + self.bwt[start:i].tobytes().count(char)
+
+    def lf(self, i):
+        '''
+        return LF mapping of row i
+        '''
+        char = self.bwt[i]
+        return self.carr[char] + self.rank(char, i)
+
+    def backwardSearch(self, pattern):
+        '''
+        return the half-open range of bwm rows prefixed by pattern using backward search
+        '''
+        lo, hi = 0, self.n
+        for char in reversed(pattern.encode()):
+            if char not in self.carr:
+                return 0, 0
+            lo = self.carr[char] + self.rank(char, lo)
+            hi = self.carr[char] + self.rank(char, hi)
+            if lo >= hi:
+                return 0, 0
+        return lo, hi
+
+    def count(self, pattern):
+        '''
+        return the number of occurrences of pattern in the text
+        '''
+        lo, hi = self.backwardSearch(pattern)
+        return hi - lo
+
+    def resolve(self, row):
+        '''
+        return the suffix array value of row by walking LF to the nearest sampled row
+        '''
+        steps = 0
+        while not self.sa_marks[row]:
+            row = self.lf(row)
+            steps += 1
+        block = row // self.occ_rate
+        start = block * self.occ_rate
+        idx = self.sa_rank[block] + self.sa_marks[start:row].tobytes().count(1)
+        return self.sa_samples[idx] + steps
+
+    def locate(self, pattern):
+        '''
+        return sorted list of positions where pattern occurs in the text
+        '''
+        lo, hi = self.backwardSearch(pattern)
+        return sorted([self.resolve(row) for row in range(lo, hi)])
+
+class RIndex:
+    '''
+    run-length compressed index over the BWT of a text (r-index).
+    only run heads, run starts and suffix array values at run boundaries are kept,
+    so memory grows with the number of runs r of the BWT rather than with its length.
+    '''
+    def __init__(self, T):
+        # the index needs a unique sentinel at the end of the text, which may sort after other characters
+        if not T.endswith('$'):
+            T = T + '$'
+        assert T.count('$') == 1, "Text should contain '$' only as its last character."
+
+        s, upper = rankText(T)
+        sa = sais(s, upper)
+        del s
+
+        self.n = len(T)
+        bwt = ''.join([T[i - 1] for i in sa])
+
+        # run heads, start rows of runs and suffix array values at run starts
+        heads = []
+        self.run_starts = array('l')
+        self.run_start_sa = array('l')
+        run_ends = []
+        for match in re.finditer(r'(.)\1*', bwt, re.S):
+            heads.append(match.group(1))
+            self.run_starts.append(match.start())
+            self.run_start_sa.append(sa[match.start()])
+            run_ends.append(match.end() - 1)
+        self.heads = ''.join(heads)
+        del bwt
+
+        # runs of each character and the number of its occurrences before each of them
+        self.char_runs = {}
+        self.char_cum = {}
+        for k, char in enumerate(self.heads):
+            if char not in self.char_runs:
+                self.char_runs[char] = array('l')
+                self.char_cum[char] = array('l', [0])
+            length = (self.run_starts[k + 1] if k + 1 < len(self.heads) else self.n) - self.run_starts[k]
+            self.char_runs[char].append(k)
+            self.char_cum[char].append(self.char_cum[char][-1] + length)
+
+        self.carr = {}
+        cum = 0
+        for char in sorted(self.char_runs.keys()):
+            self.carr[char] = cum
+            cum += self.char_cum[char][-1]
+
+        # LF keeps consecutive rows of a run consecutive, so the suffix array value of the next row
+        # only has to be kept for the rows LF reaches from run ends, keyed by their text position
+        pairs = []
+        for k, end in enumerate(run_ends):
+            row = self.carr[self.heads[k]] + self.rank(self.heads[k], end)
+            if row + 1 < self.n:
+                pairs.append((sa[row], sa[row + 1]))
+        pairs.sort()
+        self.phi_keys = array('l', [key for key, value in pairs])
+        self.phi_values = array('l', [value for key, value in pairs])
+
+    def runOf(self, i):
+        '''
+        return index of the run containing row i
+        '''
+        return bisect_right(self.run_starts, i) - 1
+
+    def rank(self, char, i):
+        '''
+        return the number of occurrences of char in bwt[0:i]
+        '''
+        if char not in self.char_runs:
+            return 0
+        k = self.runOf(i)
+        runs = self.char_runs[char]
+        j = bisect_left(runs, k)
+        ret = self.char_cum[char][j]
+        # row i lies in a run of char, so add the part of that run before it
+        if j < len(runs) and runs[j] == k:
+            ret += i - self.run_starts[k]
+        return ret
+
+    def lf(self, i):
+        '''
+        return LF mapping of row i
+        '''
+        char = self.heads[self.runOf(i)]
+        return self.carr[char] + self.rank(char, i)
+
+    def backwardSearch(self, pattern):
+        '''
+        return the half-open range of bwm rows prefixed by pattern and the suffix array value of its first row
+        '''
+        # row 0 starts the first run, whose suffix array value is kept
+        lo, hi, sa_lo = 0, self.n, self.run_start_sa[0]
+        for char in reversed(pattern):
+            if char not in self.carr:
+                return 0, 0, None
+            k = self.runOf(lo)
+            if self.heads[k] == char:
+                sa_lo = (sa_lo - 1) % self.n
+            else:
+                # otherwise the first char in the range starts a run whose suffix array value is kept
+                runs = self.char_runs[char]
+                j = bisect_right(runs, k)
+                if j == len(runs) or self.run_starts[runs[j]] >= hi:
+                    return 0, 0, None
+                sa_lo = (self.run_start_sa[runs[j]] - 1) % self.n
+            lo = self.carr[char] + self.rank(char, lo)
+            hi = self.carr[char] + self.rank(char, hi)
+        return lo, hi, sa_lo
+
+    def count(self, pattern):
+        '''
+        return the number of occurrences of pattern in the text
+        '''
+        lo, hi, sa_lo = self.backwardSearch(pattern)
+        return hi - lo
+
+    def phiInverse(self, p):
+        '''
+        return the suffix array value of the row following the row of text position p
+        '''
+        # positions up to the next key have next rows at the same offset as the key
+        idx = bisect_left(self.phi_keys, p)
+        return self.phi_values[idx] - (self.phi_keys[idx] - p)
+
+    def locate(self, pattern):
+        '''
+        return sorted list of positions where pattern occurs in the text
+        '''
+        lo, hi, sa_lo = self.backwardSearch(pattern)
+        if lo >= hi:
+            return []
+        ret = [sa_lo]
+        for row in range(lo + 1, hi):
+            ret.append(self.phiInverse(ret[-1]))
+        return sorted(ret)
+
+def searchPatterns(index, patterns_f):
+    '''
+    print count and positions of each pattern line of patterns_f in index
+    '''
+    for line in patterns_f:
+        pattern = line.strip()
+        positions = index.locate(pattern)
+        print(pattern, len(positions), ','.join([str(x) for x in positions]) if positions else '-1')
+    patterns_f.close()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Burrows-Wheeler Transform.')
     parser.add_argument('--encode', action='store_true')
     parser.add_argument('--decode', action='store_true')
-    parser.add_argument('infile', type=argparse.FileType('r'), )
+    parser.add_argument('--search', type=argparse.FileType('r'), metavar='PATTERNS',
+                        help='answer each line of PATTERNS with its count and positions in infile')
+    parser.add_argument('--occ-rate', type=int, default=32, help='rows between occurrence checkpoints')
+    parser.add_argument('--sa-rate', type=int, default=32, help='text positions between suffix array samples')
+    parser.add_argument('--index', choices=['fm', 'r'], default='fm',
+                        help='search with a sampled FM-index or a run-length compressed r-index')
+    parser.add_argument('--isa-rate', type=int, default=0,
+                        help='when encoding, also print inverse suffix array checkpoints every ISA_RATE positions')
+    parser.add_argument('--workers', type=int, default=1, help='processes used for checkpointed segments or blocks')
+    parser.add_argument('--format', choices=['text', 'binary', 'block'], default='text',
+                        help='run length format of the encoded bwt, or a container of independently encoded blocks')
+    parser.add_argument('--mtf', action='store_true', help='move-to-front code binary run symbols')
+    parser.add_argument('--entropy', action='store_true', help='huffman code binary runs')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help='bytes per block of the block format')
+    parser.add_argument('--block', type=int, default=None, help='decode only block BLOCK of a container')
+    parser.add_argument('--index-file', metavar='PATH',
+                        help='load the FM-index for searching from PATH, or build it from infile and save it there')
+    parser.add_argument('infile', type=argparse.FileType('r'), nargs='?')
     
     args = parser.parse_args()
-    if args.encode and args.decode:
-        print("You must choose either encoding or decoding.")
-        exit(2)
-    elif not args.encode and not args.decode:
-        print("You must choose either encoding or decoding.")
+    if [args.encode, args.decode, args.search is not None].count(True) != 1:
+        print("You must choose either encoding, decoding or searching.")
         exit(2)
     
+    if args.index_file and args.index == 'r':
+        print("Index files hold FM-indexes only, they cannot be used with the r-index.")
+        exit(2)
+
+    # a saved index answers searches without reading the text
+    if args.search and args.index_file and os.path.isfile(args.index_file):
+        index = FMIndex.load(args.index_file)
+        searchPatterns(index, args.search)
+        exit(0)
+
+    if args.infile is None:
+        print("You must give an input file.")
+        exit(2)
+
+    # block containers are read from the decoded file as a whole, not as a single line
+    if args.format == 'block':
+        if args.search or args.isa_rate > 0:
+            print("Block mode is only supported for plain encoding and decoding.")
+            exit(2)
+        if args.encode:
+            blockEncoding(args.infile.buffer, sys.stdout.buffer, args.block_size, args.workers, args.mtf, args.entropy)
+        elif args.block is not None:
+            sys.stdout.buffer.write(blockAt(args.infile.buffer, args.block))
+        else:
+            blockDecoding(args.infile.buffer, sys.stdout.buffer, args.workers)
+        args.infile.close()
+        exit(0)
+
+    if args.format == 'binary':
+        if args.search or args.isa_rate > 0:
+            print("Binary format is only supported for plain encoding and decoding.")
+            exit(2)
+        if args.encode:
+            bwt = bwtString(args.infile.read().strip())
+            binaryRunLengthEncoding(io.BytesIO(bwt.encode()), sys.stdout.buffer, args.mtf, args.entropy)
+        else:
+            bwt = io.BytesIO()
+            binaryRunLengthDecoding(args.infile.buffer, bwt)
+            print(bwtInversion(bwt.getvalue().decode(), workers=args.workers))
+        args.infile.close()
+        exit(0)
+
     infile = args.infile
     input_lines = infile.readlines()
     infile.close()
     input_string = input_lines[0].strip()
     
-    if len(input_lines) != 1:
+    # a decoding input may carry the checkpoint line written by --encode --isa-rate
+    if len(input_lines) != 1 and not (args.decode and len(input_lines) == 2):
         print("Input file should consist of one-line string.")
         exit(2)
     else:
         if args.encode:
-            print(bwtEncoding(input_string))
+            if args.isa_rate > 0:
+                encoded, checkpoints = bwtEncodingWithCheckpoints(input_string, args.isa_rate)
+                print(encoded)
+                print(args.isa_rate, ','.join([str(x) for x in checkpoints]))
+            else:
+                print(bwtEncoding(input_string))
         if args.decode:
-            print(bwtDecoding(input_string))
\ No newline at end of file
+            if len(input_lines) == 2:
+                step, checkpoints = input_lines[1].split()
+                checkpoints = array('l', [int(x) for x in checkpoints.split(',')])
+                print(bwtDecoding(input_string, checkpoints, int(step), args.workers))
+            else:
+                print(bwtDecoding(input_string))
+        if args.search:
+            if args.index == 'r':
+                index = RIndex(input_string)
+            else:
+                index = FMIndex(input_string, args.occ_rate, args.sa_rate)
+                if args.index_file:
+                    index.save(args.index_file)
+            searchPatterns(index, args.search)
\ No newline at end of file
@@ -1,4 +1,16 @@
-import sys
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+# pairs of sequences aligned per task of the pool
+PAIR_CHUNK_SIZE = 64
+# k-mer length and number of hash functions of the MinHash sketches used to shortlist center candidates
+SKETCH_K = 8
+SKETCH_SIZE = 64
+# 2-bit codes of nucleotides for k-mer hashing, any other character counts as A
+BASE_CODES = np.zeros(256, dtype=np.uint64)
+BASE_CODES[[ord(x) for x in 'ACGT']] = np.arange(4, dtype=np.uint64)
 
 def edit_dist(s1, s2, mismatch_cost=1, ins_cost=1, del_cost=1):
     '''
@@ -16,10 +28,11 @@ def edit_dist(s1, s2, mismatch_cost=1, ins_cost=1, del_cost=1):
     H = [[0 for i in range(m + 1)] for i in range(n + 1)] # scoring matrix
     T = [[0 for i in range(m + 1)] for i in range(n + 1)] # backtrack matrix
 
-    # initialize the first row and column with incrementing number
+    # initialize the first row and column with incrementing gap costs
     for i in range(1, n + 1):
-        H[0][i] = i
-        H[i][0] = i
+        H[i][0] = i * del_cost
+    for j in range(1, m + 1):
+        H[0][j] = j * ins_cost
 
     for i in range(1, n + 1):
         for j in range(1, m + 1):
@@ -81,6 +94,68 @@ def edit_dist(s1, s2, mismatch_cost=1, ins_cost=1, del_cost=1):
     return H[n][m], backtrack_to_align()
 
 
+def edit_dist_score(s1, s2, mismatch_cost=1, ins_cost=1, del_cost=1):
+    '''
+    calculate only the edit distance between two sequences, without alignment,
+    bit-parallel for unit costs and with two rows of the scoring matrix otherwise
+    '''
+    if mismatch_cost == ins_cost == del_cost == 1:
+        return myers_dist(s1, s2)
+
+    n = len(s1)
+    m = len(s2)
+
+    prev = [j * ins_cost for j in range(m + 1)]
+    for i in range(1, n + 1):
+        cur = [i * del_cost] + [0] * m
+        x = s1[i - 1]
+        for j in range(1, m + 1):
+            cur[j] = min(prev[j] + del_cost,
+                         cur[j - 1] + ins_cost,
+                         prev[j - 1] + (0 if x == s2[j - 1] else mismatch_cost))
+        prev = cur
+    return prev[m]
+
+def myers_dist(s1, s2):
+    '''
+    calculate the unit-cost edit distance between two sequences with Myers' bit-vector algorithm
+    in Hyyro's formulation, one column of the scoring matrix per character of s2 as bits of an integer
+    reference: H. Hyyro, A bit-vector algorithm for computing Levenshtein and Damerau edit distances, 2003
+    '''
+    n = len(s1)
+    if n == 0 or not s2:
+        return max(n, len(s2))
+
+    # bit i of peq[x] is set where s1[i] is x
+    peq = {}
+    for i, x in enumerate(s1):
+        peq[x] = peq.get(x, 0) | (1 << i)
+
+    mask = (1 << n) - 1
+    last = 1 << (n - 1)
+    # vertical deltas of the current column, +1 in pv and -1 in mv
+    pv = mask
+    mv = 0
+    score = n
+    for x in s2:
+        eq = peq.get(x, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        # horizontal deltas of the column, +1 in ph and -1 in mh
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # the first row grows by one per column of a global alignment
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score
+
+
 def collapse_alns(aln1, aln2):
     '''
     collapse two alignments using the center sequences as pivot
@@ -142,11 +217,244 @@ def collapse_alns(aln1, aln2):
     return [new_center] + rest1 + rest2
 
 
-if __name__ == '__main__':
+def gap_insertions(center1, center2):
+    '''
+    walk two forms of the center sequence like collapse_alns and return where it inserts gaps,
+    as (indices, tail) for the rows aligned with center1 and for the rows aligned with center2:
+    indices are the nondecreasing positions gaps are inserted at, one after another into the growing rows,
+    and tail is the number of gaps appended at the end
+    '''
+    ins1 = []
+    ins2 = []
+
+    i = 0
+    j = 0
+
+    while i < len(center1) and j < len(center2):
+        if center1[i] == '-' and center2[j] == '-':
+            i += 1
+            j += 1
+        elif center1[i] == '-' and center2[j] != '-':
+            ins2.append(j)
+            i += 1
+        elif center1[i] != '-' and center2[j] == '-':
+            ins1.append(i)
+            j += 1
+        else:
+            if center1[i] != center2[j]:
+                print("something wrong")
+                exit(2)
+            else:
+                i += 1
+                j += 1
+
+    return (ins1, len(center2) - j), (ins2, len(center1) - i)
 
-    input_f = open(sys.argv[1], "r")
+def gap_profile(length, inserts, tail):
+    '''
+    return the columns the characters of a row of length end up in once gaps are inserted at inserts
+    and tail gaps are appended, as a numpy array, and the new length of the row
+    '''
+    columns = np.empty(length, dtype=np.int64)
+    t = 0
+    out = 0
+    for p in inserts:
+        # characters before the insertion point keep their order, the gap goes after them
+        if p > out:
+            columns[t:t + p - out] = np.arange(out, p)
+            t += p - out
+            out = p
+        out += 1
+    columns[t:] = np.arange(out, out + length - t)
+    return columns, out + length - t + tail
+
+def merge_alns(alns):
+    '''
+    merge pairwise alignments having the center sequence first into one multiple alignment, center sequence first,
+    the same as collapsing them one after another with collapse_alns.
+    instead of rebuilding every row for every gap, each merge only records the columns its rows move to,
+    the column maps are composed from the last merge back and every row is written once into a preallocated buffer
+    '''
+    center = alns[0][0]
+
+    # column maps of the merged rows and of the new row of each merge
+    merges = []
+    for aln in alns[1:]:
+        (ins1, tail1), (ins2, tail2) = gap_insertions(center, aln[0])
+        columns1, length = gap_profile(len(center), ins1, tail1)
+        columns2, length = gap_profile(len(aln[0]), ins2, tail2)
+        merges.append((columns1, columns2))
+
+        # only the center sequence is rendered between merges, the next merge walks it
+        row = np.full(length, ord('-'), dtype=np.uint8)
+        row[columns1] = np.frombuffer(center.encode(), dtype=np.uint8)
+        center = row.tobytes().decode()
+
+    # final columns of the positions of the rows entering each merge, from the last merge back
+    final = np.arange(len(center))
+    new_rows = []
+    for columns1, columns2 in reversed(merges):
+        new_rows.append(final[columns2])
+        final = final[columns1]
+    new_rows.reverse()
+
+    msa = np.full((len(alns) + 1, len(center)), ord('-'), dtype=np.uint8)
+    msa[0, final] = np.frombuffer(alns[0][0].encode(), dtype=np.uint8)
+    msa[1, final] = np.frombuffer(alns[0][1].encode(), dtype=np.uint8)
+    for k, columns in enumerate(new_rows):
+        msa[k + 2, columns] = np.frombuffer(alns[k + 1][1].encode(), dtype=np.uint8)
+
+    return [row.tobytes().decode() for row in msa]
+
+
+def pair_chunks(n, chunk_size):
+    '''
+    yield lists of up to chunk_size pairs (i, j) with i < j of n sequences
+    '''
+    chunk = []
+    for i in range(n):
+        for j in range(i + 1, n):
+            chunk.append((i, j))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def init_pair_worker(sequences):
+    global pair_sequences
+    pair_sequences = sequences
+
+def score_pairs(pairs):
+    '''
+    return (i, j, distance) of edit_dist_score for each pair (i, j) of pair_sequences
+    '''
+    return [(i, j, edit_dist_score(pair_sequences[i], pair_sequences[j])) for i, j in pairs]
+
+def align_pairs(pairs):
+    '''
+    return (i, j, distance, alignment) of edit_dist for each pair (i, j) of pair_sequences
+    '''
+    return [(i, j) + edit_dist(pair_sequences[i], pair_sequences[j]) for i, j in pairs]
+
+def map_pairs(func, sequences, pairs, workers=1):
+    '''
+    yield the results of func on chunks of pairs of sequences, computed in a pool of workers, in any order
+    '''
+    if workers > 1:
+        pool = Pool(workers, init_pair_worker, (sequences,))
+        yield from pool.imap_unordered(func, pairs)
+        pool.close()
+        pool.join()
+    else:
+        init_pair_worker(sequences)
+        yield from map(func, pairs)
+
+def pairwise_distances(sequences, workers=1, chunk_size=PAIR_CHUNK_SIZE):
+    '''
+    return the distance matrix of sequences as a numpy array, scoring chunks of pairs without alignment
+    in a pool of workers
+    '''
+    n = len(sequences)
+    dist_matrix = np.zeros((n, n), dtype=np.int64)
+    for chunk in map_pairs(score_pairs, sequences, pair_chunks(n, chunk_size), workers):
+        for i, j, dist in chunk:
+            dist_matrix[i, j] = dist_matrix[j, i] = dist
+    return dist_matrix
+
+def center_alignments(sequences, center, workers=1, chunk_size=PAIR_CHUNK_SIZE):
+    '''
+    return the alignments of the center sequence with every other sequence in order, center sequence first,
+    each pair aligned in the same order (i, j), i < j, as in the distance matrix
+    '''
+    n = len(sequences)
+    pairs = [(min(i, center), max(i, center)) for i in range(n) if i != center]
+    chunks = [pairs[k:k + chunk_size] for k in range(0, len(pairs), chunk_size)]
+
+    alignments = {}
+    for chunk in map_pairs(align_pairs, sequences, chunks, workers):
+        for i, j, dist, aln in chunk:
+            alignments[i, j] = aln
+
+    # this step for placing center sequence at 0-index always
+    return [alignments[i, j] if i == center else alignments[i, j][::-1] for i, j in pairs]
+
+
+def minhash_sketches(sequences, k=SKETCH_K, size=SKETCH_SIZE):
+    '''
+    return the MinHash sketches of the k-mer sets of sequences as an (n, size) numpy array,
+    each column the minimum of one multiply-add hash over the 2-bit codes of the k-mers
+    '''
+    rng = np.random.default_rng(0)
+    multipliers = rng.integers(1, 1 << 62, size, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 1 << 62, size, dtype=np.uint64)
+    powers = np.uint64(4) ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+
+    # sequences without any k-mer keep the largest hash everywhere
+    sketches = np.full((len(sequences), size), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for i, seq in enumerate(sequences):
+        if len(seq) < k:
+            continue
+        bases = BASE_CODES[np.frombuffer(seq.encode(), dtype=np.uint8)]
+        codes = np.unique(np.lib.stride_tricks.sliding_window_view(bases, k) @ powers)
+        # uint64 arithmetic wraps around, which is the hash modulo 2^64
+        sketches[i] = (codes[:, None] * multipliers + offsets).min(axis=0)
+    return sketches
+
+def sketch_shortlist(sequences, shortlist, k=SKETCH_K, size=SKETCH_SIZE, block_size=64):
+    '''
+    return the indices of the shortlist sequences with the lowest overall sketch distance,
+    the estimated Jaccard distance of their k-mer sets to every sequence, lowest first and the first one on ties
+    '''
+    sketches = minhash_sketches(sequences, k, size)
+    n = len(sequences)
+    # sequences without any k-mer share the same sketch, so they are kept at distance 1 from everything
+    empty = np.array([len(seq) < k for seq in sequences], dtype=bool)
+    totals = np.zeros(n)
+    # a block of rows is compared with all sketches at once
+    for start in range(0, n, block_size):
+        block = sketches[start:start + block_size]
+        distances = (block[:, None, :] != sketches[None, :, :]).mean(axis=2)
+        distances[:, empty] = 1
+        distances[empty[start:start + block_size]] = 1
+        totals[start:start + block_size] = distances.sum(axis=1)
+    return np.argsort(totals, kind='stable')[:shortlist].tolist()
+
+def candidate_distances(sequences, candidates, workers=1, chunk_size=PAIR_CHUNK_SIZE):
+    '''
+    return the overall edit distance of each candidate sequence to all sequences, as a dict,
+    scoring the pairs of candidates in chunks in a pool of workers
+    '''
+    n = len(sequences)
+    pairs = sorted(set((min(c, j), max(c, j)) for c in candidates for j in range(n) if j != c))
+    chunks = [pairs[k:k + chunk_size] for k in range(0, len(pairs), chunk_size)]
+
+    totals = dict.fromkeys(candidates, 0)
+    for chunk in map_pairs(score_pairs, sequences, chunks, workers):
+        for i, j, dist in chunk:
+            if i in totals:
+                totals[i] += dist
+            if j in totals:
+                totals[j] += dist
+    return totals
+
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description='Center-star multiple sequence alignment.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--workers', type=int, default=1, help='processes scoring and aligning the pairs of sequences')
+    parser.add_argument('--chunk-size', type=int, default=PAIR_CHUNK_SIZE, help='pairs scored or aligned per task')
+    parser.add_argument('--shortlist', type=int,
+                        help='choose the center among the SHORTLIST sequences closest by MinHash sketch distance')
+    parser.add_argument('--sketch-k', type=int, default=SKETCH_K, help='k-mer length of the sketches')
+    parser.add_argument('--sketch-size', type=int, default=SKETCH_SIZE, help='hash functions per sketch')
+    args = parser.parse_args()
+
+    input_f = open(args.input, "r")
     input_lines = input_f.readlines()
-    output_f = open(sys.argv[2], "w")
+    output_f = open(args.output, "w")
 
     input_names = []
     input_sequences = []
@@ -161,51 +469,30 @@ if __name__ == '__main__':
 
     n = len(input_sequences)
 
-    # pair-wise distance matrix
-    dist_matrix = [[0 for i in range(n)] for i in range(n)]
-    # pair-wise alignment matrix
-    aln_matrix = [["" for i in range(n)] for i in range(n)]
-
-    for i in range(n):
-        for j in range(i, n):
-            # zero distance between sequence and itself
-            if i == j:
-                dist_matrix[i][j] = 0
-            else:
-                # fill out pair-wise distance and alignment matrix
-                calculated_dist, aln = edit_dist(input_sequences[i], input_sequences[j])
-                dist_matrix[i][j] = dist_matrix[j][i] = calculated_dist
-                aln_matrix[i][j] = aln
-                # this step for placing center sequence at 0-index always
-                aln_matrix[j][i] = aln[::-1]
-
-    min_seq_idx = 0
-    min_overall_dist = float('inf')
-    over_all_dist = []
-    # find center sequence with minimum overall distance
-    for i in range(n):
-        sum = 0
-
-        for j in range(n):
-            sum += dist_matrix[i][j]
-
-        if sum < min_overall_dist:
-            min_overall_dist = sum
-            min_seq_idx = i
-        over_all_dist.append(sum)
+    if args.shortlist:
+        # only the candidates closest by sketch distance are scored against every sequence,
+        # the overall distances of the others are unknown and printed as '-'
+        candidates = sketch_shortlist(input_sequences, args.shortlist, args.sketch_k, args.sketch_size)
+        totals = candidate_distances(input_sequences, candidates, args.workers, args.chunk_size)
+        min_seq_idx = min(totals, key=lambda i: (totals[i], i))
+        over_all_dist = [totals.get(i, '-') for i in range(n)]
+    else:
+        # pair-wise distance matrix, scored without alignment
+        dist_matrix = pairwise_distances(input_sequences, args.workers, args.chunk_size)
+
+        # find center sequence with minimum overall distance, the first one on ties
+        over_all_dist = dist_matrix.sum(axis=1).tolist()
+        min_seq_idx = int(np.argmin(over_all_dist)) if n else 0
 
     # print each overall distance
     print(','.join([str(x) for x in over_all_dist]))
 
-    # list of alignments having center sequence as first element, also not having alignment with itself
-    alns = []
-    for i in [i for i in range(n) if i != min_seq_idx]:
-        alns.append(aln_matrix[min_seq_idx][i])
+    # list of alignments having center sequence as first element, also not having alignment with itself,
+    # the only pairs ever aligned
+    alns = center_alignments(input_sequences, min_seq_idx, args.workers, args.chunk_size)
 
-    # collapse alignments
-    tmp = collapse_alns(alns[0], alns[1])
-    for i in range(2,len(alns)):
-        tmp = collapse_alns(tmp, alns[i])
+    # collapse alignments, rendering the multiple alignment once
+    tmp = merge_alns(alns)
 
     # after collapsing, center sequence is at first, so relocate it at its original position
     result = tmp[1:]
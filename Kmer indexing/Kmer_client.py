@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import os.path
+import time
+
+from Kmer_server import parse_address
+
+async def open_connection(address):
+    '''
+    return (reader, writer) connected to the server at address
+    '''
+    kind, host, port = parse_address(address)
+    if kind == 'tcp':
+        return await asyncio.open_connection(host, port)
+    return await asyncio.open_unix_connection(host)
+
+async def send_queries(address, queries):
+    '''
+    return the answer lines of queries from one connection, writing all queries before reading
+    '''
+    reader, writer = await open_connection(address)
+
+    async def write():
+        for query in queries:
+            writer.write(query.encode() + b'\n')
+        await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+
+    sender = asyncio.ensure_future(write())
+    ret = []
+    for i in range(len(queries)):
+        ret.append((await reader.readline()).decode())
+    await sender
+    writer.close()
+    return ret
+
+async def query_server(address, queries, connections=1):
+    '''
+    return the answer lines of queries, split into contiguous parts over connections in parallel
+    '''
+    size = (len(queries) + connections - 1) // connections or 1
+    parts = [queries[i:i + size] for i in range(0, len(queries), size)]
+    answers = await asyncio.gather(*[send_queries(address, part) for part in parts])
+    return [line for part in answers for line in part]
+
+def benchmark(address, queries, connections=1, repeat=5):
+    '''
+    send queries repeat times and return the query throughput of each round per second
+    the first round fills the server cache, later rounds are answered from it
+    '''
+    ret = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        asyncio.run(query_server(address, queries, connections))
+        ret.append(len(queries) / (time.perf_counter() - start))
+    return ret
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description='K-mer query client.')
+    parser.add_argument('address', help='"host:port" of the server over TCP, or its Unix socket path')
+    parser.add_argument('queries_text')
+    parser.add_argument('--connections', type=int, default=1, help='connections the queries are split over')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='ROUNDS',
+                        help='report the throughput of ROUNDS rounds instead of writing queries_indices.txt')
+    args = parser.parse_args()
+
+    # sanity check
+    assert os.path.isfile(args.queries_text), "queries file does not exist."
+    assert args.connections > 0, "connections should be positive."
+
+    # queries text parsing
+    queries_f = open(args.queries_text, "r")
+    queries = [line.strip() for line in queries_f]
+    queries_f.close()
+
+    if args.benchmark:
+        for i, rate in enumerate(benchmark(args.address, queries, args.connections, args.benchmark)):
+            print("round " + str(i + 1) + ": " + str(int(rate)) + " queries/s")
+    else:
+        output_queries_indices = open("queries_indices.txt", "w")
+        output_queries_indices.writelines(asyncio.run(query_server(args.address, queries, args.connections)))
+        output_queries_indices.close()
@@ -1,5 +1,35 @@
-import sys
+import argparse
+import gzip
+import heapq
+import io
+import mmap
 import os.path
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 2-bit codes of nucleotides, in lexicographic order so that codes sort like k-mers
+NUCLEOTIDES = 'ACGT'
+# any other byte translates to 4, which breaks the k-mers spanning it
+ENCODE_TABLE = bytes([NUCLEOTIDES.find(chr(x)) if chr(x) in NUCLEOTIDES else 4 for x in range(256)])
+# code of k-mers spanning a non-nucleotide byte, sorts after every real code
+INVALID_CODE = (1 << 64) - 1
+# records are joined by a separator in the indexed coordinates
+RECORD_SEPARATOR = b'$'
+# longest k-mer whose 2-bit code fits below INVALID_CODE, longer ones are indexed by the dictionary engine
+MAX_PACKED_K = 31
+CHUNK_SIZE = 1 << 24
+# bits of a code sorted per pass when numpy is not available
+RADIX_BITS = 11
+# code range buckets indexed per worker of a parallel build
+BUCKETS_PER_WORKER = 4
 
 def kmer_indexing(main_text, k):
     kmer_index = {}
@@ -13,21 +43,981 @@ def kmer_indexing(main_text, k):
 
     return kmer_index
 
-def index_dict_to_string(index_dict):
+class RecordKmerIndex(dict):
+    '''
+    dictionary k-mer index of named records joined by RECORD_SEPARATOR, whose positions are
+    mapped back to record_names by record_starts like those of PackedKmerIndex
+    '''
+    def __init__(self, index, record_names, record_starts):
+        super().__init__(index)
+        self.record_names = record_names
+        self.record_starts = record_starts
+
+    def position_labels(self, positions):
+        return record_labels(self.record_names, self.record_starts, positions)
+
+def record_labels(record_names, record_starts, positions):
+    '''
+    return positions as strings, prefixed with their record name if records are named
+    '''
+    if record_names is None:
+        return [str(x) for x in positions]
+    ret = []
+    for x in positions:
+        r = bisect_right(record_starts, x) - 1
+        ret.append(record_names[r] + ':' + str(x - record_starts[r]))
+    return ret
+
+def encode_kmer(kmer):
+    '''
+    return 2-bit packed code of kmer
+    '''
+    code = 0
+    for x in kmer.encode().translate(ENCODE_TABLE):
+        code = (code << 2) | x
+    return code
+
+def decode_kmer(code, k):
+    '''
+    return k-mer of 2-bit packed code
+    '''
+    ret = []
+    for i in range(k):
+        ret.append(NUCLEOTIDES[code & 3])
+        code >>= 2
+    return ''.join(reversed(ret))
+
+def reverse_complement_code(code, k):
+    '''
+    return 2-bit packed code of the reverse complement of the k-mer of code
+    '''
+    ret = 0
+    for i in range(k):
+        ret = (ret << 2) | (3 - (code & 3))
+        code >>= 2
+    return ret
+
+def rolling_codes(main_text, k, canonical=False):
+    '''
+    return 2-bit packed codes of every k-mer of main_text, updated by rolling one base at a time
+    k-mers spanning a non-nucleotide get INVALID_CODE, and with canonical the smaller of
+    the k-mer and its reverse complement is taken
+    '''
+    assert 0 < k <= MAX_PACKED_K, "k should be between 1 and " + str(MAX_PACKED_K) + " for packed codes."
+    if isinstance(main_text, str):
+        main_text = main_text.encode()
+
+    mask = (1 << (2 * k)) - 1
+    shift = 2 * (k - 1)
+    codes = array('Q')
+    code = 0
+    rc = 0
+    valid = 0
+    for i, x in enumerate(main_text.translate(ENCODE_TABLE)):
+        if x > 3:
+            valid = 0
+        else:
+            code = ((code << 2) | x) & mask
+            rc = (rc >> 2) | ((3 - x) << shift)
+            valid += 1
+        if i >= k - 1:
+            if valid < k:
+                codes.append(INVALID_CODE)
+            elif canonical and rc < code:
+                codes.append(rc)
+            else:
+                codes.append(code)
+    return codes
+
+def position_typecode(n):
+    '''
+    return the smallest array typecode that can hold positions below n
+    '''
+    return 'I' if n < 1 << 32 else 'Q'
+
+# binary index file: header, then uint64 codes, uint64 offsets, uint32 or uint64 positions padded
+# to 8 bytes, uint64 record starts, the indexed text of a minimizer index and newline-separated record names
+INDEX_MAGIC = b'KMERIDX\0'
+INDEX_VERSION = 3
+INDEX_HEADER = struct.Struct('<8sII4sIIQQQIQ')
+INDEX_FLAG_CANONICAL = 1
+INDEX_FLAG_RECORDS = 2
+
+class PackedKmerIndex:
+    '''
+    k-mer index over 2-bit packed codes in CSR form:
+    positions of codes[i] are positions[offsets[i]:offsets[i + 1]], with codes sorted ascending.
+    positions are offsets in the records joined by RECORD_SEPARATOR, and record_starts maps them
+    back to record_names when the input had named records.
+    '''
+    # window of a minimizer index, 0 when every k-mer is indexed
+    w = 0
+
+    def __init__(self, k, codes, offsets, positions, canonical=False, record_names=None, record_starts=None):
+        self.k = k
+        self.codes = codes
+        self.offsets = offsets
+        self.positions = positions
+        self.canonical = canonical
+        self.record_names = record_names
+        self.record_starts = record_starts
+
+    def kmer_code(self, kmer):
+        '''
+        return the code kmer is indexed under
+        '''
+        code = encode_kmer(kmer)
+        if self.canonical:
+            code = min(code, reverse_complement_code(code, self.k))
+        return code
+
+    def position_labels(self, positions):
+        '''
+        return positions as strings, prefixed with their record name if records are named
+        '''
+        return record_labels(self.record_names, self.record_starts, positions)
+
+    def lookup(self, code):
+        '''
+        return positions of code, empty if it does not occur
+        '''
+        i = bisect_left(self.codes, code)
+        if i < len(self.codes) and self.codes[i] == code:
+            return self.positions[self.offsets[i]:self.offsets[i + 1]]
+        return self.positions[0:0]
+
+    def lookup_many(self, codes):
+        '''
+        return dict from each code of ascending codes that occurs to its positions
+        a single forward pass over the sorted codes of the index serves the whole batch
+        '''
+        ret = {}
+        lo = 0
+        for code in codes:
+            i = bisect_left(self.codes, code, lo)
+            if i < len(self.codes) and self.codes[i] == code:
+                ret[code] = self.positions[self.offsets[i]:self.offsets[i + 1]]
+            lo = i
+        return ret
+
+    def __contains__(self, kmer):
+        return len(kmer) == self.k and len(self.lookup(self.kmer_code(kmer))) > 0
+
+    def __getitem__(self, kmer):
+        return self.lookup(self.kmer_code(kmer))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def save(self, path):
+        '''
+        write the index to path in the binary format read by load()
+        '''
+        flags = (INDEX_FLAG_CANONICAL if self.canonical else 0) | (INDEX_FLAG_RECORDS if self.record_names else 0)
+        record_starts = self.record_starts if self.record_names else array('Q')
+        text = self.text[self.text_start:self.text_end] if self.w else b''
+        with open(path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.k, NUCLEOTIDES.encode(),
+                                      self.positions.itemsize, flags, len(self.codes), len(self.positions),
+                                      len(record_starts), self.w, len(text)))
+            f.write(self.codes)
+            f.write(self.offsets)
+            f.write(self.positions)
+            f.write(bytes(-len(self.positions) * self.positions.itemsize % 8))
+            f.write(record_starts)
+            f.write(text)
+            if self.record_names:
+                f.write('\n'.join(self.record_names).encode())
+
+    @classmethod
+    def load(cls, path):
+        '''
+        return the index saved at path, served from a read-only memory map of the file
+        '''
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = INDEX_HEADER.unpack_from(mm)
+        magic, version, k, alphabet, itemsize, flags, ncodes, npositions, nrecords, w, text_len = header
+        assert magic == INDEX_MAGIC, "File is not a k-mer index."
+        assert version == INDEX_VERSION, "K-mer index version " + str(version) + " is not supported."
+        assert alphabet == NUCLEOTIDES.encode(), "K-mer index has a different alphabet."
+
+        view = memoryview(mm)
+        pos = INDEX_HEADER.size
+        codes = view[pos:pos + 8 * ncodes].cast('Q')
+        pos += 8 * ncodes
+        offsets = view[pos:pos + 8 * (ncodes + 1)].cast('Q')
+        pos += 8 * (ncodes + 1)
+        positions = view[pos:pos + itemsize * npositions].cast('I' if itemsize == 4 else 'Q')
+        pos += (itemsize * npositions + 7) // 8 * 8
+
+        record_starts = view[pos:pos + 8 * nrecords].cast('Q')
+        pos += 8 * nrecords
+        # the text of a minimizer index is searched in place in the map
+        text_start = pos
+        pos += text_len
+        if flags & INDEX_FLAG_RECORDS:
+            record_names = mm[pos:].decode().split('\n')
+        else:
+            record_names = None
+            record_starts = None
+
+        if w:
+            return MinimizerKmerIndex(k, w, codes, offsets, positions, mm, text_start, text_start + text_len,
+                                      record_names, record_starts)
+        return PackedKmerIndex(k, codes, offsets, positions, bool(flags & INDEX_FLAG_CANONICAL),
+                               record_names, record_starts)
+
+    def keys(self):
+        '''
+        yield indexed k-mers in sorted order
+        '''
+        for code in self.codes:
+            yield decode_kmer(code, self.k)
+
+def numpy_array(a):
+    '''
+    return a writable numpy view of array a of typecode 'I' or 'Q'
+    '''
+    return np.frombuffer(a, dtype=np.uint32 if a.itemsize == 4 else np.uint64)
+
+def radix_sort_codes(codes, positions, bits):
+    '''
+    return codes and positions stably sorted by codes of the given bits, by LSD radix passes
+    of RADIX_BITS bits into preallocated arrays
+    '''
+    n = len(codes)
+    mask = (1 << RADIX_BITS) - 1
+    for shift in range(0, bits, RADIX_BITS):
+        counts = [0] * (mask + 1)
+        for code in codes:
+            counts[(code >> shift) & mask] += 1
+        if max(counts) == n:
+            continue
+        starts = [0] * (mask + 1)
+        for d in range(1, mask + 1):
+            starts[d] = starts[d - 1] + counts[d - 1]
+        out_codes = array('Q', [0]) * n
+        out_positions = array(positions.typecode, [0]) * n
+        for code, pos in zip(codes, positions):
+            d = (code >> shift) & mask
+            i = starts[d]
+            out_codes[i] = code
+            out_positions[i] = pos
+            starts[d] = i + 1
+        codes, positions = out_codes, out_positions
+    return codes, positions
+
+def sort_codes(codes, positions, k):
+    '''
+    return codes of k-mers and their positions without invalid codes, stably sorted by code,
+    so the positions of each code stay in their order. numpy's stable argsort is used when available,
+    and radix_sort_codes otherwise, neither boxing a Python object per k-mer
+    '''
+    if np is not None:
+        view = numpy_array(codes)
+        order = np.argsort(view, kind='stable')
+        # invalid k-mers sort last
+        n = len(codes) - int(np.count_nonzero(view == INVALID_CODE))
+        sorted_codes = array('Q', [0]) * n
+        np.take(view, order[:n], out=numpy_array(sorted_codes))
+        sorted_positions = array(positions.typecode, [0]) * n
+        np.take(numpy_array(positions), order[:n], out=numpy_array(sorted_positions))
+        return sorted_codes, sorted_positions
+
+    valid = array('Q')
+    valid_positions = array(positions.typecode)
+    for code, pos in zip(codes, positions):
+        if code != INVALID_CODE:
+            valid.append(code)
+            valid_positions.append(pos)
+    return radix_sort_codes(valid, valid_positions, 2 * k)
+
+def csr_offsets(codes):
+    '''
+    return the distinct codes of ascending codes and the offsets where the run of each starts,
+    with a final offset past the last code
+    '''
+    if np is not None:
+        view = numpy_array(codes)
+        # a run starts wherever the code differs from the one before it
+        starts = np.ones(len(codes), dtype=bool)
+        np.not_equal(view[1:], view[:-1], out=starts[1:])
+        n = int(np.count_nonzero(starts))
+        unique_codes = array('Q', [0]) * n
+        np.compress(starts, view, out=numpy_array(unique_codes))
+        offsets = array('Q', [0]) * (n + 1)
+        numpy_array(offsets)[:n] = np.flatnonzero(starts)
+        offsets[n] = len(codes)
+        return unique_codes, offsets
+
+    unique_codes = array('Q')
+    offsets = array('Q')
+    for i, code in enumerate(codes):
+        if not unique_codes or unique_codes[-1] != code:
+            unique_codes.append(code)
+            offsets.append(i)
+    offsets.append(len(codes))
+    return unique_codes, offsets
+
+def packed_kmer_indexing(main_text, k, canonical=False):
+    '''
+    build PackedKmerIndex of main_text, skipping k-mers that contain anything but A,C,G and T
+    '''
+    codes = rolling_codes(main_text, k, canonical)
+    codes, positions = sort_codes(codes, array(position_typecode(len(main_text)), range(len(codes))), k)
+    unique_codes, offsets = csr_offsets(codes)
+    return PackedKmerIndex(k, unique_codes, offsets, positions, canonical)
+
+def read_sequences(f):
+    '''
+    yield (record number, record name, sequence line) from a FASTA, FASTQ or plain sequence file opened in binary mode
+    all lines of a plain sequence file form a single record without a name
+    '''
+    record = -1
+    name = None
+    fastq = False
+    seq_len = 0
+    quality_left = 0
+
+    for line in f:
+        line = line.rstrip(b'\r\n')
+        # fastq quality lines are skipped by length, since they may start with '@' or '+'
+        if quality_left > 0:
+            quality_left -= len(line)
+            continue
+        if line.startswith(b'>') or line.startswith(b'@'):
+            record += 1
+            fields = line[1:].split()
+            name = fields[0].decode() if fields else str(record)
+            fastq = line.startswith(b'@')
+            seq_len = 0
+            continue
+        if fastq and line.startswith(b'+'):
+            quality_left = seq_len
+            continue
+        if not line:
+            continue
+        if record < 0:
+            record = 0
+        seq_len += len(line)
+        yield record, name, line
+
+def validate_sequences(records):
+    '''
+    pass records from read_sequences through, checking each line in bulk with a deleting translation
+    '''
+    for record, name, line in records:
+        invalid = line.translate(None, NUCLEOTIDES.encode())
+        assert not invalid, "Sequence should consist of A,T,G and C. Your sequence has " + chr(invalid[0]) + "."
+        yield record, name, line
+
+def sequence_chunks(records, k, chunk_size, names, starts):
+    '''
+    yield (start, text) chunks of records joined by RECORD_SEPARATOR, each holding the k-mers starting
+    in [start, start + chunk_size) so that neighbours overlap by k-1, and fill names and starts of the records
+    '''
+    buf = bytearray()
+    buf_start = 0
+    current = None
+
+    for record, name, line in records:
+        if record != current:
+            if current is not None:
+                buf += RECORD_SEPARATOR
+            current = record
+            names.append(name)
+            starts.append(buf_start + len(buf))
+        buf += line
+        # chunks are cut at a moving offset and the buffer is shifted once per line
+        pos = 0
+        while len(buf) - pos >= chunk_size + k - 1:
+            yield buf_start, bytes(buf[pos:pos + chunk_size + k - 1])
+            pos += chunk_size
+            buf_start += chunk_size
+        del buf[:pos]
+
+    # the rest holds the k-1 bases shared with the previous chunk and any bases after them
+    if len(buf) > (k - 1 if buf_start else 0):
+        yield buf_start, bytes(buf)
+
+def join_records(records, names, starts):
+    '''
+    return the sequences of records joined by RECORD_SEPARATOR, filling names and starts of the records
+    '''
+    text = bytearray()
+    for start, chunk in sequence_chunks(records, 1, CHUNK_SIZE, names, starts):
+        text += chunk
+    return bytes(text)
+
+def dict_kmer_indexing(records, k):
+    '''
+    build the dictionary index of records of read_sequences over their joined coordinates,
+    as a RecordKmerIndex when the records are named
+    '''
+    names = []
+    starts = array('Q')
+    index = kmer_indexing(join_records(records, names, starts).decode(), k)
+    # k-mers spanning two records are not in the text
+    if len(names) > 1:
+        index = {kmer: positions for kmer, positions in index.items() if RECORD_SEPARATOR.decode() not in kmer}
+    # plain sequence files keep plain offsets
+    if any(name is not None for name in names):
+        index = RecordKmerIndex(index, names, starts)
+    return index
+
+def bucket_bits(k, workers):
+    '''
+    return the bits of code prefix that split codes into BUCKETS_PER_WORKER buckets per worker,
+    so that buckets of uneven size still keep every worker busy
+    '''
+    if workers <= 1:
+        return 0
+    return min(2 * k, (BUCKETS_PER_WORKER * workers - 1).bit_length())
+
+def sort_chunk(task):
+    '''
+    return the codes of one chunk sorted with their global positions, as (codes, positions)
+    of each of the 2^bits buckets of codes sharing their top bits
+    '''
+    chunk, k, start, canonical, bits = task
+    codes = rolling_codes(chunk, k, canonical)
+    positions = array(position_typecode(start + len(chunk)), range(start, start + len(codes)))
+    codes, positions = sort_codes(codes, positions, k)
+
+    ret = []
+    lo = 0
+    for bucket in range(1, (1 << bits) + 1):
+        hi = bisect_left(codes, bucket << (2 * k - bits)) if bucket < 1 << bits else len(codes)
+        ret.append((codes[lo:hi], positions[lo:hi]))
+        lo = hi
+    return ret
+
+def index_bucket(task):
+    '''
+    return codes, offsets and positions of the packed index of one bucket, given as the sorted
+    (codes, positions) of each chunk in text order, with offsets shifted by base
+    '''
+    parts, k, base = task
+    typecode = 'Q' if any(positions.typecode == 'Q' for codes, positions in parts) else 'I'
+    codes = array('Q')
+    positions = array(typecode)
+    for part_codes, part_positions in parts:
+        codes.extend(part_codes)
+        positions.extend(part_positions if part_positions.typecode == typecode else array(typecode, part_positions))
+    if len(parts) > 1:
+        # chunks come in text order, so a stable sort keeps the positions of each code ascending
+        codes, positions = sort_codes(codes, positions, k)
+
+    unique_codes, offsets = csr_offsets(codes)
+    if base and np is not None:
+        numpy_array(offsets)[:] += base
+    elif base:
+        offsets = array('Q', [x + base for x in offsets])
+    return unique_codes, offsets, positions
+
+def build_kmer_index(records, k, workers=1, canonical=False, chunk_size=CHUNK_SIZE):
+    '''
+    build PackedKmerIndex from records of read_sequences in a pool of workers: chunks of the records
+    are sorted by code and split into buckets of code range, then each bucket is indexed on its own
+    and the buckets are concatenated, so no merge runs in a single process
+    '''
+    names = []
+    starts = array('Q')
+    bits = bucket_bits(k, workers)
+    tasks = ((chunk, k, start, canonical, bits)
+             for start, chunk in sequence_chunks(records, k, chunk_size, names, starts))
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        chunks = list(pool.imap(sort_chunk, tasks) if pool else map(sort_chunk, tasks))
+
+        # the offsets of each bucket start after the positions of the buckets before it
+        bucket_tasks = []
+        base = 0
+        for bucket in range(1 << bits):
+            parts = [chunk[bucket] for chunk in chunks]
+            bucket_tasks.append((parts, k, base))
+            base += sum(len(codes) for codes, positions in parts)
+        del chunks
+        buckets = list(pool.imap(index_bucket, bucket_tasks) if pool else map(index_bucket, bucket_tasks))
+        del bucket_tasks
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    typecode = 'Q' if any(positions.typecode == 'Q' for codes, offsets, positions in buckets) else 'I'
+    codes = array('Q')
+    offsets = array('Q')
+    positions = array(typecode)
+    for bucket_codes, bucket_offsets, bucket_positions in buckets:
+        codes.extend(bucket_codes)
+        offsets.extend(bucket_offsets[:-1])
+        positions.extend(bucket_positions if bucket_positions.typecode == typecode else array(typecode, bucket_positions))
+    offsets.append(base)
+
+    index = PackedKmerIndex(k, codes, offsets, positions, canonical)
+    # plain sequence files keep plain offsets
+    if any(name is not None for name in names):
+        index.record_names = names
+        index.record_starts = starts
+    return index
+
+def parallel_kmer_indexing(main_text, k, workers, chunk_size=None):
+    '''
+    build PackedKmerIndex of main_text by indexing overlapping chunks in a pool of workers
+    '''
+    if isinstance(main_text, str):
+        main_text = main_text.encode()
+    if chunk_size is None:
+        chunk_size = max(1, (len(main_text) - k + 1 + workers - 1) // workers)
+    return build_kmer_index([(0, None, main_text)], k, workers, chunk_size=chunk_size)
+
+def minimizer_hash(code):
+    '''
+    return a scrambled 64-bit hash of code, so that minimizers are not biased towards poly-A k-mers
+    '''
+    return (code * 0x9E3779B97F4A7C15) & INVALID_CODE
+
+def minimizer_positions(codes, w):
+    '''
+    return ascending positions of the (w,k)-minimizers among codes of consecutive k-mers
+    the minimizer of each window of w k-mers is the leftmost one with the smallest hash
+    '''
+    ret = array('Q')
+    # positions of the window with increasing hashes, so the front is its minimizer
+    window = deque()
+    for i, code in enumerate(codes):
+        if code != INVALID_CODE:
+            h = minimizer_hash(code)
+            while window and window[-1][0] > h:
+                window.pop()
+            window.append((h, i))
+        if i >= w - 1:
+            while window and window[0][1] <= i - w:
+                window.popleft()
+            if window and (not ret or ret[-1] != window[0][1]):
+                ret.append(window[0][1])
+    return ret
 
-    ret = ""
+class MinimizerKmerIndex(PackedKmerIndex):
+    '''
+    k-mer index that keeps only the positions of (w,k)-minimizers together with the indexed text.
+    every occurrence of a query of length at least w+k-1 contains a whole window of the query,
+    so it is found among the positions of the query's minimizers and verified against the text.
+    '''
+    def __init__(self, k, w, codes, offsets, positions, text, text_start, text_end,
+                 record_names=None, record_starts=None):
+        super().__init__(k, codes, offsets, positions, False, record_names, record_starts)
+        self.w = w
+        # text is bytes or a memory map holding the indexed text in [text_start, text_end)
+        self.text = text
+        self.text_start = text_start
+        self.text_end = text_end
+
+    def scan(self, query):
+        '''
+        return positions of query by scanning the text, for queries too short to contain a window
+        '''
+        ret = []
+        i = self.text.find(query, self.text_start, self.text_end)
+        while i >= 0:
+            ret.append(i - self.text_start)
+            i = self.text.find(query, i + 1, self.text_end)
+        return ret
+
+    def locate(self, query):
+        '''
+        return sorted positions of query in the text
+        '''
+        query = query.encode()
+        # like the exact index, answer only queries of at least k bases
+        if len(query) < self.k:
+            return []
+        if len(query) < self.w + self.k - 1:
+            return self.scan(query)
+
+        # seed from the query minimizer with the fewest positions
+        codes = rolling_codes(query, self.k)
+        seed_offset, seeds = None, None
+        for j in minimizer_positions(codes, self.w):
+            candidates = self.lookup(codes[j])
+            if seeds is None or len(candidates) < len(seeds):
+                seed_offset, seeds = j, candidates
+
+        # a loaded index maps the record names right after its text, so matches must end within the text
+        ret = []
+        end = self.text_end - len(query)
+        for p in seeds:
+            start = self.text_start + p - seed_offset
+            if self.text_start <= start <= end and self.text[start:start + len(query)] == query:
+                ret.append(p - seed_offset)
+        return ret
+
+def minimizer_kmer_indexing(records, k, w):
+    '''
+    build MinimizerKmerIndex from records of read_sequences
+    '''
+    names = []
+    starts = array('Q')
+    text = join_records(records, names, starts)
+
+    codes = rolling_codes(text, k)
+    minimizers = array(position_typecode(len(text)), minimizer_positions(codes, w))
+    codes, positions = sort_codes(array('Q', [codes[pos] for pos in minimizers]), minimizers, k)
+    unique_codes, offsets = csr_offsets(codes)
+
+    # plain sequence files keep plain offsets
+    if not any(name is not None for name in names):
+        names, starts = None, None
+    return MinimizerKmerIndex(k, w, unique_codes, offsets, positions, text, 0, len(text), names, starts)
+
+# k-mers of at most DENSE_MAX_K bases are counted exactly in an array of 4^k counters
+DENSE_MAX_K = 11
+SKETCH_WIDTH = 1 << 20
+SKETCH_DEPTH = 4
+# bases counted per chunk, whose distinct k-mers are added to the counts at once
+COUNT_CHUNK_SIZE = 1 << 16
+# odd multipliers of the multiply-shift hashes of the sketch rows
+SKETCH_MULTIPLIERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                      0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9)
+
+class DenseKmerCounts:
+    '''
+    exact k-mer counts in an array indexed by 2-bit packed code
+    '''
+    def __init__(self, k, canonical=False):
+        self.k = k
+        self.canonical = canonical
+        self.counts = array('Q', bytes(8 << (2 * k)))
+        self.total = 0
+
+    def add(self, code, count=1):
+        '''
+        add count occurrences of code and return its count
+        '''
+        self.counts[code] += count
+        self.total += count
+        return self.counts[code]
+
+    def estimate(self, code):
+        return self.counts[code]
+
+    def __getitem__(self, kmer):
+        return self.estimate(kmer_count_code(self, kmer))
+
+    def top(self, n):
+        '''
+        return the n most frequent k-mers as (kmer, count), most frequent first
+        '''
+        codes = heapq.nlargest(n, range(len(self.counts)), key=self.counts.__getitem__)
+        return [(decode_kmer(code, self.k), self.counts[code]) for code in codes if self.counts[code]]
+
+class KmerCountSketch:
+    '''
+    count-min sketch of k-mer counts in depth rows of width counters, with width a power of 2.
+    an estimate never falls below the true count and exceeds it by at most e*total/width
+    with probability 1-exp(-depth). the n most frequent k-mers seen so far are tracked by estimate.
+    '''
+    def __init__(self, k, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, n=0, canonical=False):
+        assert width & (width - 1) == 0, "Sketch width should be a power of 2."
+        assert 0 < depth <= len(SKETCH_MULTIPLIERS), "Sketch depth should be between 1 and " + str(len(SKETCH_MULTIPLIERS)) + "."
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.canonical = canonical
+        self.shift = 64 - width.bit_length() + 1
+        self.table = array('Q', bytes(8 * width * depth))
+        self.total = 0
+        # heavy hitters: estimate of each tracked code and a heap of (estimate, code) with stale entries
+        self.n = n
+        self.heavy = {}
+        self.heap = []
+
+    def cells(self, code):
+        '''
+        return the counter of code in each row
+        '''
+        return [row * self.width + (((code * SKETCH_MULTIPLIERS[row]) & INVALID_CODE) >> self.shift)
+                for row in range(self.depth)]
+
+    def add(self, code, count=1):
+        '''
+        add count occurrences of code and return its estimated count
+        '''
+        table = self.table
+        ret = INVALID_CODE
+        for cell in self.cells(code):
+            table[cell] += count
+            ret = min(ret, table[cell])
+        self.total += count
+        if self.n:
+            self.track(code, ret)
+        return ret
+
+    def track(self, code, estimate):
+        '''
+        keep code among the heavy hitters if its estimate is one of the n largest
+        '''
+        heavy = self.heavy
+        heap = self.heap
+        if code not in heavy:
+            if len(heavy) >= self.n:
+                # drop stale heap entries to find the smallest tracked estimate
+                while heap[0][0] != heavy[heap[0][1]]:
+                    heapq.heappop(heap)
+                if heap[0][0] >= estimate:
+                    return
+                del heavy[heapq.heappop(heap)[1]]
+        heavy[code] = estimate
+        heapq.heappush(heap, (estimate, code))
+        # stale entries are bounded so the heap stays proportional to n
+        if len(heap) > 4 * self.n:
+            self.heap = [(value, x) for x, value in heavy.items()]
+            heapq.heapify(self.heap)
+
+    def estimate(self, code):
+        table = self.table
+        return min(table[cell] for cell in self.cells(code))
+
+    def __getitem__(self, kmer):
+        return self.estimate(kmer_count_code(self, kmer))
+
+    def top(self, n):
+        '''
+        return up to n tracked heavy hitters as (kmer, estimated count), most frequent first
+        '''
+        heavy = sorted(self.heavy.items(), key=lambda x: (-x[1], x[0]))[:n]
+        return [(decode_kmer(code, self.k), count) for code, count in heavy]
+
+def kmer_count_code(counts, kmer):
+    '''
+    return the code kmer is counted under
+    '''
+    code = encode_kmer(kmer)
+    if counts.canonical:
+        code = min(code, reverse_complement_code(code, counts.k))
+    return code
+
+def count_kmers(records, k, n=10, canonical=False, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, dense_max_k=DENSE_MAX_K,
+                chunk_size=COUNT_CHUNK_SIZE):
+    '''
+    count k-mers of records of read_sequences without keeping positions, exactly in DenseKmerCounts
+    for k up to dense_max_k and in a KmerCountSketch tracking the n most frequent k-mers otherwise.
+    records are read chunk_size bases at a time, so memory beyond the counts stays bounded by the chunk
+    '''
+    if k <= dense_max_k:
+        counts = DenseKmerCounts(k, canonical)
+    else:
+        counts = KmerCountSketch(k, width, depth, n, canonical)
+
+    names = []
+    starts = array('Q')
+    for start, chunk in sequence_chunks(records, k, chunk_size, names, starts):
+        # counting repeats of a chunk first updates each distinct k-mer once
+        chunk_counts = Counter(rolling_codes(chunk, k, canonical))
+        chunk_counts.pop(INVALID_CODE, None)
+        for code, count in chunk_counts.items():
+            counts.add(code, count)
+    return counts
+
+def query_tiles(query, k):
+    '''
+    return offsets of k-mers that cover query, the last one aligned to its end
+    '''
+    offsets = list(range(0, len(query) - k + 1, k))
+    if offsets[-1] != len(query) - k:
+        offsets.append(len(query) - k)
+    return offsets
+
+def contains_sorted(positions, x):
+    i = bisect_left(positions, x)
+    return i < len(positions) and positions[i] == x
+
+def batch_kmer_query(index, queries):
+    '''
+    return sorted positions of every query in PackedKmerIndex index
+    queries of length k are looked up directly, longer ones are seeded from their rarest covering k-mer
+    and verified against the positions of the other covering k-mers, shorter ones have no positions.
+    a canonical index does not record the strand of its k-mers, so it cannot verify the tiles of longer
+    queries and rejects them, and a minimizer index locates each query against its text
+    '''
+    if isinstance(index, MinimizerKmerIndex):
+        return [index.locate(query) for query in queries]
+    k = index.k
+    if index.canonical:
+        assert all(len(query) <= k for query in queries), \
+            "Canonical index answers only queries of at most k bases, it does not record strands."
+
+    # encode the covering k-mers of all queries and look their codes up in one sorted pass
+    query_codes = []
+    for query in queries:
+        if len(query) < k:
+            query_codes.append(None)
+        else:
+            query_codes.append([(j, index.kmer_code(query[j:j + k])) for j in query_tiles(query, k)])
+    found = index.lookup_many(sorted(set(code for tiles in query_codes if tiles for j, code in tiles)))
+
+    ret = []
+    for tiles in query_codes:
+        if tiles is None or any(code not in found for j, code in tiles):
+            ret.append([])
+            continue
+        if len(tiles) == 1:
+            ret.append(found[tiles[0][1]])
+            continue
+        # seed from the rarest k-mer and verify the others at their offsets
+        tiles = sorted(tiles, key=lambda tile: len(found[tile[1]]))
+        seed_offset, seed_code = tiles[0]
+        matches = []
+        for p in found[seed_code]:
+            start = p - seed_offset
+            if start >= 0 and all(contains_sorted(found[code], start + j) for j, code in tiles[1:]):
+                matches.append(start)
+        ret.append(matches)
 
-    for key in sorted(index_dict.keys()):
-        ret += key + " " + ','.join([str(x) for x in index_dict[key]]) + '\n'
     return ret
 
+def position_labels(index_dict, positions):
+    '''
+    return positions as strings, labelled with their records for a PackedKmerIndex or RecordKmerIndex
+    '''
+    if isinstance(index_dict, (PackedKmerIndex, RecordKmerIndex)):
+        return index_dict.position_labels(positions)
+    return [str(x) for x in positions]
+
+# text outputs are written in pieces of about this many characters
+OUTPUT_BUFFER_SIZE = 1 << 20
+# queries answered per batch_kmer_query call while streaming results
+QUERY_BATCH_SIZE = 1 << 16
+# binary query results: header, then per query its length, number of positions, bases and uint64 positions
+QUERIES_MAGIC = b'KMERQRY\0'
+QUERIES_VERSION = 1
+QUERIES_HEADER = struct.Struct('<8sII')
+QUERY_RECORD = struct.Struct('<IQ')
+
+def index_items(index_dict):
+    '''
+    yield (kmer, positions) of index_dict in sorted order
+    '''
+    if isinstance(index_dict, PackedKmerIndex):
+        # codes are already sorted, so walk the CSR arrays instead of looking each k-mer up
+        offsets = index_dict.offsets
+        for i, code in enumerate(index_dict.codes):
+            yield decode_kmer(code, index_dict.k), index_dict.positions[offsets[i]:offsets[i + 1]]
+    else:
+        for key in sorted(index_dict.keys()):
+            yield key, index_dict[key]
+
+def write_lines(f, lines, buffer_size=OUTPUT_BUFFER_SIZE):
+    '''
+    write lines to f, joining them into pieces of about buffer_size characters
+    '''
+    buf = []
+    size = 0
+    for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            f.write(''.join(buf))
+            buf = []
+            size = 0
+    f.write(''.join(buf))
+
+def write_kmer_index(index_dict, f, sep=" ", buffer_size=OUTPUT_BUFFER_SIZE):
+    '''
+    stream the k-mers of index_dict with their positions to f, one "kmer<sep>positions" line each
+    '''
+    write_lines(f, (key + sep + ','.join(position_labels(index_dict, positions)) + '\n'
+                    for key, positions in index_items(index_dict)), buffer_size)
+
+def query_results(index_dict, queries, batch_size=QUERY_BATCH_SIZE):
+    '''
+    yield positions of each query in index_dict, answering a PackedKmerIndex batch by batch
+    '''
+    if isinstance(index_dict, PackedKmerIndex):
+        for i in range(0, len(queries), batch_size):
+            yield from batch_kmer_query(index_dict, queries[i:i + batch_size])
+    else:
+        for query in queries:
+            yield index_dict.get(query, [])
+
+def write_query_results(index_dict, queries, f, sep=" ", buffer_size=OUTPUT_BUFFER_SIZE):
+    '''
+    stream the positions of each query to f, one "query<sep>positions" line each with -1 for no positions
+    '''
+    write_lines(f, (query + sep + (','.join(position_labels(index_dict, positions)) if len(positions) else '-1') + '\n'
+                    for query, positions in zip(queries, query_results(index_dict, queries))), buffer_size)
+
+def write_binary_query_results(index, queries, f):
+    '''
+    write the positions of each query in PackedKmerIndex index to f in the binary query format
+    positions are offsets in the joined records, mapped back to records by the saved index
+    '''
+    f.write(QUERIES_HEADER.pack(QUERIES_MAGIC, QUERIES_VERSION, index.k))
+    for query, positions in zip(queries, query_results(index, queries)):
+        f.write(QUERY_RECORD.pack(len(query), len(positions)))
+        f.write(query.encode())
+        f.write(array('Q', positions))
+
+def read_binary_query_results(f):
+    '''
+    yield (query, positions) from a file written by write_binary_query_results
+    '''
+    magic, version, k = QUERIES_HEADER.unpack(f.read(QUERIES_HEADER.size))
+    assert magic == QUERIES_MAGIC, "Not a k-mer query result file."
+    assert version == QUERIES_VERSION, "Unsupported query result version " + str(version) + "."
+    while True:
+        header = f.read(QUERY_RECORD.size)
+        if not header:
+            break
+        length, n = QUERY_RECORD.unpack(header)
+        query = f.read(length).decode()
+        positions = array('Q')
+        positions.frombytes(f.read(8 * n))
+        yield query, positions
+
+def index_dict_to_string(index_dict):
+    ret = io.StringIO()
+    write_kmer_index(index_dict, ret)
+    return ret.getvalue()
+
 def kmer_query(index_dict, query):
 
-    if query in index_dict.keys():
-        return ','.join([str(x) for x in index_dict[query]])
+    if query in index_dict:
+        return ','.join(position_labels(index_dict, index_dict[query]))
     else:
         return '-1'
 
+def load_or_build_index(records, k, index_file=None, engine='packed', index_type='exact', window=10,
+                        workers=1, canonical=False):
+    '''
+    return the index of records of read_sequences, memory-mapped from index_file if it exists
+    and otherwise built with the given engine and index type, and saved to index_file if given.
+    k-mers longer than MAX_PACKED_K are always indexed by the dictionary engine
+    '''
+    if k > MAX_PACKED_K:
+        assert not index_file and not canonical and index_type == 'exact', \
+            "Index files, canonical and minimizer indexes need k of at most " + str(MAX_PACKED_K) + "."
+        engine = 'dict'
+
+    if index_file and os.path.isfile(index_file):
+        index = PackedKmerIndex.load(index_file)
+        assert index.k == k, "k of the saved index is " + str(index.k) + "."
+    elif index_type == 'minimizer':
+        assert not canonical, "Minimizer index does not support canonical k-mers."
+        index = minimizer_kmer_indexing(records, k, window)
+        if index_file:
+            index.save(index_file)
+    elif engine == 'packed' or index_file:
+        index = build_kmer_index(records, k, workers, canonical)
+        if index_file:
+            index.save(index_file)
+    else:
+        index = dict_kmer_indexing(records, k)
+
+    return index
+
 def is_intstring(s):
     try:
         int(s)
@@ -35,53 +1025,111 @@ def is_intstring(s):
     except ValueError:
         return False
 
-# argument parsing
-main_text = sys.argv[1]
-k = sys.argv[2]
-queries_text = sys.argv[3]
-
-# sanity check
-assert os.path.isfile(main_text), "main text file does not exist."
-assert is_intstring(k), "k is not integer."
-assert os.path.isfile(queries_text), "queries file does not exist."
-
-# variable setting
-k = int(k)
-main_text_f = open(main_text, "r")
-queries_f = open(queries_text, "r")
-output_kmer_indicies = open("kmer_indices.txt", "w")
-output_queries_indices = open("queries_indices.txt", "w")
-
-# main text parsing
-line = main_text_f.readline()
-main_sequence = line.strip()
-main_text_f.close()
-
-# sanity check
-for i in main_sequence:
-    assert i in ['A','T','G','C'], "Sequence should consist of A,T,G and C. Your sequence has " + i + "."
-
-# queries text parsing
-lines = queries_f.readlines()
-queries = []
-for line in lines:
-    query = line.strip()
-    for i in query:
-        assert i in ['A', 'T', 'G', 'C'], "Queries should consist of A,T,G and C. Your query has " + i + "."
-    queries.append(query)
-queries_f.close()
-
-# 'main_sequence' is main sequence string, 'k' is k and 'queries' is a list of query
-index_dict = kmer_indexing(main_sequence, k)
-index_dict_str = index_dict_to_string(index_dict)
-
-queries_result_str = ""
-for query in queries:
-    queries_result_str += query + " " + kmer_query(index_dict, query) +"\n"
-
-# export the result
-output_kmer_indicies.write(index_dict_str)
-output_queries_indices.write(queries_result_str)
-
-output_kmer_indicies.close()
-output_queries_indices.close()
\ No newline at end of file
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description='K-mer indexing.')
+    parser.add_argument('main_text')
+    parser.add_argument('k')
+    parser.add_argument('queries_text')
+    parser.add_argument('--engine', choices=['packed', 'dict'], default='packed',
+                        help='2-bit packed CSR index or dictionary of position lists')
+    parser.add_argument('--index-file', metavar='PATH',
+                        help='memory-map the packed index from PATH, or build it and save it there')
+    parser.add_argument('--workers', type=int, default=1, help='processes used to build the packed index')
+    parser.add_argument('--canonical', action='store_true',
+                        help='index each k-mer together with its reverse complement')
+    parser.add_argument('--index-type', choices=['exact', 'minimizer'], default='exact',
+                        help='packed index of every k-mer or only of (w,k)-minimizers')
+    parser.add_argument('--window', type=int, default=10, help='k-mers per minimizer window')
+    parser.add_argument('--output-format', choices=['text', 'tsv.gz', 'binary'], default='text',
+                        help='text files, gzipped TSV files or the binary index and query results')
+    parser.add_argument('--count', action='store_true',
+                        help='count k-mers without positions, writing kmer_counts.txt and queries_counts.txt')
+    parser.add_argument('--top', type=int, default=10, help='most frequent k-mers reported by --count')
+    parser.add_argument('--sketch-width', type=int, default=SKETCH_WIDTH,
+                        help='counters per row of the count-min sketch, a power of 2')
+    parser.add_argument('--sketch-depth', type=int, default=SKETCH_DEPTH, help='rows of the count-min sketch')
+    parser.add_argument('--dense-max-k', type=int, default=DENSE_MAX_K,
+                        help='largest k counted exactly in a 4^k array instead of the sketch')
+    parser.add_argument('--count-chunk-size', type=int, default=COUNT_CHUNK_SIZE,
+                        help='bases whose k-mers are counted together before updating the counts')
+    args = parser.parse_args()
+
+    main_text = args.main_text
+    k = args.k
+    queries_text = args.queries_text
+
+    # sanity check
+    assert os.path.isfile(main_text), "main text file does not exist."
+    assert is_intstring(k), "k is not integer."
+    assert os.path.isfile(queries_text), "queries file does not exist."
+
+    # variable setting
+    k = int(k)
+    if k > MAX_PACKED_K and (args.count or args.index_file or args.canonical or args.index_type == 'minimizer'
+                             or args.output_format == 'binary'):
+        parser.error("--count, --index-file, --canonical, --index-type minimizer and --output-format binary "
+                     "need k of at most " + str(MAX_PACKED_K))
+    main_text_f = open(main_text, "rb")
+    queries_f = open(queries_text, "r")
+
+    # main text is a FASTA, FASTQ or plain sequence file, streamed record by record and checked in bulk
+    records = validate_sequences(read_sequences(main_text_f))
+
+    # queries text parsing
+    lines = queries_f.readlines()
+    queries = []
+    for line in lines:
+        query = line.strip()
+        for i in query:
+            assert i in ['A', 'T', 'G', 'C'], "Queries should consist of A,T,G and C. Your query has " + i + "."
+        queries.append(query)
+    queries_f.close()
+
+    if args.canonical and not args.count and any(len(query) > k for query in queries):
+        parser.error("--canonical index answers only queries of at most k bases")
+
+    if args.count:
+        # only frequencies are kept, exactly for small k and in a fixed-size sketch otherwise
+        counts = count_kmers(records, k, args.top, args.canonical, args.sketch_width, args.sketch_depth, args.dense_max_k,
+                             args.count_chunk_size)
+        main_text_f.close()
+
+        output_kmer_counts = open("kmer_counts.txt", "w")
+        for kmer, count in counts.top(args.top):
+            output_kmer_counts.write(kmer + " " + str(count) + "\n")
+        output_kmer_counts.close()
+
+        output_queries_counts = open("queries_counts.txt", "w")
+        for query in queries:
+            output_queries_counts.write(query + " " + (str(counts[query]) if len(query) == k else '-1') + "\n")
+        output_queries_counts.close()
+    else:
+        index_dict = load_or_build_index(records, k, args.index_file, args.engine, args.index_type, args.window,
+                                         args.workers, args.canonical)
+        main_text_f.close()
+
+        # 'index_dict' is the index of the main text, 'k' is k and 'queries' is a list of query
+        # both outputs are streamed, so neither is held in memory as a whole
+        if args.output_format == 'binary':
+            assert isinstance(index_dict, PackedKmerIndex), "Binary output needs the packed engine."
+            index_dict.save("kmer_indices.bin")
+            output_queries_indices = open("queries_indices.bin", "wb")
+            write_binary_query_results(index_dict, queries, output_queries_indices)
+            output_queries_indices.close()
+        else:
+            if args.output_format == 'tsv.gz':
+                output_kmer_indicies = gzip.open("kmer_indices.tsv.gz", "wt")
+                output_queries_indices = gzip.open("queries_indices.tsv.gz", "wt")
+                sep = "\t"
+            else:
+                output_kmer_indicies = open("kmer_indices.txt", "w")
+                output_queries_indices = open("queries_indices.txt", "w")
+                sep = " "
+
+            # export the result
+            write_kmer_index(index_dict, output_kmer_indicies, sep)
+            write_query_results(index_dict, queries, output_queries_indices, sep)
+
+            output_kmer_indicies.close()
+            output_queries_indices.close()
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import os.path
+from collections import OrderedDict
+
+from Kmer_indexing import (MAX_PACKED_K, load_or_build_index, position_labels, query_results, read_sequences,
+                           validate_sequences, is_intstring)
+
+# results of this many distinct queries are kept
+CACHE_SIZE = 1 << 16
+# bytes read from a connection at once, whose complete lines are answered as one batch
+READ_SIZE = 1 << 16
+
+def parse_address(address):
+    '''
+    return ('tcp', host, port) for a "host:port" address and ('unix', path, None) otherwise
+    '''
+    host, sep, port = address.rpartition(':')
+    if sep and is_intstring(port):
+        return 'tcp', host or 'localhost', int(port)
+    return 'unix', address, None
+
+class KmerQueryServer:
+    '''
+    answers k-mer queries against one index over a socket, one query per line.
+    each answer is a line of queries_indices.txt, "query positions" with -1 for no positions,
+    and the answers of the cache_size most recently used queries are cached.
+    '''
+    def __init__(self, index, cache_size=CACHE_SIZE):
+        self.index = index
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def answer(self, queries):
+        '''
+        return the answer lines of queries, looking cache misses up in one batch
+        '''
+        cache = self.cache
+        misses = []
+        for query in queries:
+            if query in cache:
+                cache.move_to_end(query)
+                self.hits += 1
+            elif any(x not in 'ACGT' for x in query):
+                # other bases never occur in the index
+                cache[query] = query + " -1\n"
+            else:
+                misses.append(query)
+        self.misses += len(misses)
+
+        if misses:
+            misses = list(OrderedDict.fromkeys(misses))
+            for query, positions in zip(misses, query_results(self.index, misses)):
+                cache[query] = query + " " + (','.join(position_labels(self.index, positions)) if len(positions) else '-1') + "\n"
+
+        # answers are taken before evicting, so a batch larger than the cache is still answered
+        ret = [cache[query] for query in queries]
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return ret
+
+    async def handle(self, reader, writer):
+        '''
+        answer the queries of one connection until the client closes it
+        '''
+        rest = b''
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            lines = (rest + data).split(b'\n')
+            rest = lines.pop()
+            if lines:
+                writer.write(''.join(self.answer([line.decode().strip() for line in lines])).encode())
+                await writer.drain()
+        if rest.strip():
+            writer.write(''.join(self.answer([rest.decode().strip()])).encode())
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, address):
+        '''
+        listen on address, a "host:port" TCP address or a Unix socket path, until cancelled
+        '''
+        kind, host, port = parse_address(address)
+        if kind == 'tcp':
+            server = await asyncio.start_server(self.handle, host, port)
+        else:
+            if os.path.exists(host):
+                os.remove(host)
+            server = await asyncio.start_unix_server(self.handle, host)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if kind == 'unix' and os.path.exists(host):
+                os.remove(host)
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description='K-mer query server.')
+    parser.add_argument('main_text')
+    parser.add_argument('k')
+    parser.add_argument('--listen', default='localhost:8765', metavar='ADDRESS',
+                        help='"host:port" to listen on over TCP, or a Unix socket path')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='queries whose answers are cached')
+    parser.add_argument('--engine', choices=['packed', 'dict'], default='packed',
+                        help='2-bit packed CSR index or dictionary of position lists')
+    parser.add_argument('--index-file', metavar='PATH',
+                        help='memory-map the packed index from PATH, or build it and save it there')
+    parser.add_argument('--workers', type=int, default=1, help='processes used to build the packed index')
+    parser.add_argument('--canonical', action='store_true',
+                        help='index each k-mer together with its reverse complement')
+    parser.add_argument('--index-type', choices=['exact', 'minimizer'], default='exact',
+                        help='packed index of every k-mer or only of (w,k)-minimizers')
+    parser.add_argument('--window', type=int, default=10, help='k-mers per minimizer window')
+    args = parser.parse_args()
+
+    # sanity check
+    assert os.path.isfile(args.main_text), "main text file does not exist."
+    assert is_intstring(args.k), "k is not integer."
+    if int(args.k) > MAX_PACKED_K and (args.index_file or args.canonical or args.index_type == 'minimizer'):
+        parser.error("--index-file, --canonical and --index-type minimizer need k of at most " + str(MAX_PACKED_K))
+
+    # the index is loaded or built once and then serves every connection
+    main_text_f = open(args.main_text, "rb")
+    index = load_or_build_index(validate_sequences(read_sequences(main_text_f)), int(args.k), args.index_file,
+                                args.engine, args.index_type, args.window, args.workers, args.canonical)
+    main_text_f.close()
+
+    print("Serving k-mer queries on " + args.listen)
+    try:
+        asyncio.run(KmerQueryServer(index, args.cache_size).serve(args.listen))
+    except KeyboardInterrupt:
+        pass
@@ -1,6 +1,38 @@
-import sys
+import argparse
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# first band width tried when the band is widened automatically
+BAND_START = 16
+# columns an X-drop row is first computed past the cells alive in the row above
+XDROP_SPAN = 64
+
+def smith_waterman(a, b, match_cost, mismatch_cost, gap_cost, dp_table=True, linear_space=False, kernel='python',
+                   band=None, xdrop=None, widen=False, top=None, max_ties=None):
+    '''
+    return the dp table and the best local alignments of a and b
+    with dp_table False the table is not rendered and None is returned in its place,
+    with linear_space the alignments are recovered in linear memory by linear_alignments,
+    and kernel 'numpy' fills the dp table a row at a time with numpy instead of cell by cell.
+    band restricts the table to diagonals around the main one, widened by widen_band if widen is set,
+    and xdrop drops cells falling more than xdrop below the best score, as in pruned_rows.
+    max_ties keeps only the last max_ties cells tying the best score, which are the ones traced back first,
+    and top reports up to top non-overlapping alignments of decreasing score by declumped_alignments instead
+    '''
+    if top is not None:
+        assert not linear_space and band is None and xdrop is None and not widen, \
+            "Top alignments need the full, unpruned matrix."
+    if widen:
+        band = widen_band(a, b, match_cost, mismatch_cost, gap_cost, BAND_START if band is None else band, kernel)
+    if linear_space:
+        assert not dp_table, "dp table needs the full matrix, it cannot be kept in linear space."
+        assert band is None and xdrop is None, "Banded and X-drop alignments need the full matrix."
+        return None, linear_alignments(a, b, match_cost, mismatch_cost, gap_cost, kernel, max_ties)
 
-def smith_waterman(a, b, match_cost, mismatch_cost, gap_cost):
     def similarity_score(x, y):
         if x == y:
             return match_cost
@@ -10,37 +42,51 @@ def smith_waterman(a, b, match_cost, mismatch_cost, gap_cost):
     n = len(a)
     m = len(b)
 
-    best, besti, bestj = 0, [], []
+    if kernel == 'numpy':
+        assert np is not None, "numpy kernel needs numpy installed."
+    if band is not None or xdrop is not None:
+        H, T, besti, bestj = pruned_matrices(a, b, match_cost, mismatch_cost, gap_cost, band, xdrop, kernel)
+        best = H[besti[0]][bestj[0]] if besti else 0
+    elif kernel == 'numpy':
+        H, T, besti, bestj = numpy_smith_waterman_matrices(a, b, match_cost, mismatch_cost, gap_cost)
+        best = H.max() if besti else 0
+    else:
+        # a bounded deque keeps the ties traced back first, which are the last ones found
+        best, besti, bestj = 0, deque(maxlen=max_ties), deque(maxlen=max_ties)
 
-    H = [[0 for i in range(m + 1)] for i in range(n + 1)]
-    T = [[0 for i in range(m + 1)] for i in range(n + 1)]
+        H = [[0 for i in range(m + 1)] for i in range(n + 1)]
+        T = [[0 for i in range(m + 1)] for i in range(n + 1)]
 
-    for i in range(1, n + 1):
-        for j in range(1, m + 1):
-            deletion = (H[i - 1][j] + gap_cost, 0)
-            insertion = (H[i][j - 1] + gap_cost, 1)
-            match = (H[i - 1][j - 1] + similarity_score(a[i - 1], b[j - 1]), 2)
-            H[i][j], T[i][j] = max(
-                (0, 0),
-                deletion,
-                insertion,
-                match
-            )
-
-            if H[i][j] > best:
-                best = H[i][j]
-                besti = [i]
-                bestj = [j]
-            elif H[i][j] == best:
-                besti.append(i)
-                bestj.append(j)
-            else:
-                pass
+        for i in range(1, n + 1):
+            for j in range(1, m + 1):
+                deletion = (H[i - 1][j] + gap_cost, 0)
+                insertion = (H[i][j - 1] + gap_cost, 1)
+                match = (H[i - 1][j - 1] + similarity_score(a[i - 1], b[j - 1]), 2)
+                H[i][j], T[i][j] = max(
+                    (0, 0),
+                    deletion,
+                    insertion,
+                    match
+                )
+
+                if H[i][j] > best:
+                    best = H[i][j]
+                    besti.clear()
+                    bestj.clear()
+                    besti.append(i)
+                    bestj.append(j)
+                elif H[i][j] == best:
+                    besti.append(i)
+                    bestj.append(j)
+                else:
+                    pass
 
     if best == 0:
         besti, bestj = [], []
+    if max_ties is not None and len(besti) > max_ties:
+        besti, bestj = besti[len(besti) - max_ties:], bestj[len(bestj) - max_ties:]
 
-    def dp_table(H):
+    def render_dp_table(H):
         def split(word):
             return [char for char in word]
 
@@ -98,7 +144,501 @@ def smith_waterman(a, b, match_cost, mismatch_cost, gap_cost):
 
         return ret_align
 
-    return dp_table(H), backtrack_to_align()
+    if top is not None:
+        table = render_dp_table(H) if dp_table else None
+        if kernel == 'numpy':
+            H, T = H.tolist(), T.tolist()
+        return table, declumped_alignments(a, b, H, T, match_cost, mismatch_cost, gap_cost, top, max_ties)
+
+    return render_dp_table(H) if dp_table else None, backtrack_to_align()
+
+def declumped_alignments(a, b, H, T, match_cost, mismatch_cost, gap_cost, top, max_ties=None):
+    '''
+    return up to top non-overlapping local alignments of a and b, best first, formatted like smith_waterman,
+    in the style of Waterman and Eggert: each alignment is traced back from the cell smith_waterman would
+    trace back first, its cells are barred from later alignments and only the part of H and T below and
+    right of it that changes is recomputed. H and T are lists of lists and are modified in place.
+    at most max_ties alignments of the same score are reported
+    '''
+    n = len(a)
+    m = len(b)
+    barred = set()
+
+    # best score of each row below limit, the score whose ties are used up, updated only for changed rows
+    limit = None
+    def row_best(row):
+        top_score = max(row)
+        if limit is not None and top_score >= limit:
+            top_score = max([h for h in row if h < limit], default=0)
+        return top_score
+    row_bests = [row_best(row) for row in H]
+
+    ret_align = ""
+    last_score, ties = None, 0
+    for count in range(top):
+        best = max(row_bests)
+        if best <= 0:
+            break
+
+        # last cell of best in row-major order
+        i = n - row_bests[::-1].index(best)
+        row = H[i]
+        j = m - row[::-1].index(best)
+
+        aligned_a = []
+        aligned_b = []
+        path = {}
+        end_i = i
+        while H[i][j] > 0:
+            barred.add((i, j))
+            path.setdefault(i, []).append(j)
+            if T[i][j] == 2:
+                i -= 1
+                j -= 1
+                aligned_a.append(a[i])
+                aligned_b.append(b[j])
+            elif T[i][j] == 1:
+                j -= 1
+                aligned_a.append('_')
+                aligned_b.append(b[j])
+            else:
+                i -= 1
+                aligned_a.append(a[i])
+                aligned_b.append('_')
+        ret_align += "pos " + str(j) + "\n" + ''.join(reversed(aligned_a)) + "\n" + ''.join(reversed(aligned_b)) + "\n"
+
+        if best == last_score:
+            ties += 1
+        else:
+            last_score, ties = best, 1
+        if max_ties is not None and ties >= max_ties:
+            limit = best
+            # only rows holding the best score have their best at or above the new limit
+            row_bests = [row_best(H[r]) if h >= limit else h for r, h in enumerate(row_bests)]
+
+        # recompute the rows below the start, between the columns that changed in the row above
+        # and the barred cells of the row, until a row past the alignment is left unchanged
+        first, last = None, None
+        for r in range(i + 1, n + 1):
+            cols = path.get(r, [])
+            lo = min([c for c in (first, min(cols, default=None)) if c is not None], default=None)
+            if lo is None:
+                if r > end_i:
+                    break
+                continue
+            hi = max([c for c in (last + 1 if last is not None else None, max(cols, default=None)) if c is not None])
+            first, last = None, None
+            x = a[r - 1]
+            for c in range(lo, m + 1):
+                if (r, c) in barred:
+                    h, t = 0, 0
+                else:
+                    h, t = max((0, 0),
+                               (H[r - 1][c] + gap_cost, 0),
+                               (H[r][c - 1] + gap_cost, 1),
+                               (H[r - 1][c - 1] + (match_cost if x == b[c - 1] else mismatch_cost), 2))
+                T[r][c] = t
+                if h != H[r][c]:
+                    H[r][c] = h
+                    if first is None:
+                        first = c
+                    last = c
+                elif c > hi:
+                    break
+            if first is not None:
+                row_bests[r] = row_best(H[r])
+
+    return ret_align
+
+def python_score_rows(a, b, match_cost, mismatch_cost, gap_cost, local=True):
+    '''
+    yield the rows of the dp table of a and b as lists, from row 0
+    local rows are floored at 0 as in Smith-Waterman, global rows are not as in Needleman-Wunsch
+    '''
+    m = len(b)
+    prev = [0] * (m + 1) if local else [j * gap_cost for j in range(m + 1)]
+    yield prev
+    for i in range(1, len(a) + 1):
+        cur = [0 if local else i * gap_cost] + [0] * m
+        x = a[i - 1]
+        for j in range(1, m + 1):
+            h = max(prev[j] + gap_cost,
+                    cur[j - 1] + gap_cost,
+                    prev[j - 1] + (match_cost if x == b[j - 1] else mismatch_cost))
+            cur[j] = h if h > 0 or not local else 0
+        yield cur
+        prev = cur
+
+def query_profile(a, b, match_cost, mismatch_cost):
+    '''
+    return, for each base of a, the array of its similarity scores against every base of b
+    '''
+    b_codes = np.frombuffer(b.encode(), dtype=np.uint8)
+    return {x: np.where(b_codes == ord(x), match_cost, mismatch_cost).astype(np.int64) for x in set(a)}
+
+def numpy_row(prev, scores, gap_cost, first, chain):
+    '''
+    return the dp row following prev, with scores the similarity of its base against b and first its column 0
+    the gap chain along the row, cur[j] = max(e[j], cur[j - 1] + gap_cost), is unrolled into
+    cur[j] = max over k <= j of e[k] + (j - k) * gap_cost, a cumulative max over e - chain where chain[j] = j * gap_cost.
+    first is None for a local row, which is floored at 0
+    '''
+    e = prev + gap_cost
+    np.maximum(e[1:], prev[:-1] + scores, out=e[1:])
+    if first is None:
+        np.maximum(e, 0, out=e)
+        e[0] = 0
+    else:
+        e[0] = first
+    e -= chain
+    np.maximum.accumulate(e, out=e)
+    e += chain
+    return e
+
+def numpy_score_rows(a, b, match_cost, mismatch_cost, gap_cost, local=True):
+    '''
+    yield the rows of the dp table of a and b as int64 arrays, from row 0, like python_score_rows
+    each row is computed at once from the previous one by numpy_row with a query profile of b
+    '''
+    m = len(b)
+    chain = np.arange(m + 1, dtype=np.int64) * gap_cost
+    profile = query_profile(a, b, match_cost, mismatch_cost)
+    prev = np.zeros(m + 1, dtype=np.int64) if local else chain.copy()
+    yield prev
+    for i in range(1, len(a) + 1):
+        prev = numpy_row(prev, profile[a[i - 1]], gap_cost, None if local else i * gap_cost, chain)
+        yield prev
+
+def score_rows(a, b, match_cost, mismatch_cost, gap_cost, local=True, kernel='python'):
+    '''
+    yield the rows of the dp table of a and b computed by the given kernel, 'python' or 'numpy'
+    '''
+    if kernel == 'numpy':
+        assert np is not None, "numpy kernel needs numpy installed."
+        return numpy_score_rows(a, b, match_cost, mismatch_cost, gap_cost, local)
+    return python_score_rows(a, b, match_cost, mismatch_cost, gap_cost, local)
+
+def numpy_smith_waterman_matrices(a, b, match_cost, mismatch_cost, gap_cost):
+    '''
+    return H and T of smith_waterman and its best cells as lists besti and bestj, filled row by row with numpy.
+    ties of T are broken like smith_waterman: match over insertion over deletion or 0
+    '''
+    n = len(a)
+    m = len(b)
+    H = np.zeros((n + 1, m + 1), dtype=np.int64)
+    T = np.zeros((n + 1, m + 1), dtype=np.int8)
+
+    best, besti, bestj = 0, [], []
+    rows = numpy_score_rows(a, b, match_cost, mismatch_cost, gap_cost)
+    next(rows)
+    profile = query_profile(a, b, match_cost, mismatch_cost)
+    for i, row in enumerate(rows, 1):
+        H[i] = row
+        cur = row[1:]
+        T[i, 1:] = np.where(H[i - 1, :-1] + profile[a[i - 1]] == cur, 2, np.where(row[:-1] + gap_cost == cur, 1, 0))
+
+        top = cur.max() if m else 0
+        if top >= best and top > 0:
+            js = (np.flatnonzero(cur == top) + 1).tolist()
+            if top > best:
+                best, besti, bestj = top, [], []
+            besti += [i] * len(js)
+            bestj += js
+
+    return H, T, besti, bestj
+
+def band_diagonals(n, m, band):
+    '''
+    return the lowest and highest diagonal j - i of a band of width band around the diagonals
+    between the two corners of an n x m dp table
+    '''
+    return min(0, m - n) - band, max(0, m - n) + band
+
+def row_window(row, row_lo, lo, hi, kernel='python'):
+    '''
+    return columns lo..hi of a row holding only the columns from row_lo on, with 0 for the columns it does not hold
+    '''
+    s = max(lo, row_lo)
+    e = min(hi, row_lo + len(row) - 1)
+    if kernel == 'numpy':
+        ret = np.zeros(max(0, hi - lo + 1), dtype=np.int64)
+        if s <= e:
+            ret[s - lo:e - lo + 1] = row[s - row_lo:e - row_lo + 1]
+        return ret
+    if s > e:
+        return [0] * max(0, hi - lo + 1)
+    return [0] * (s - lo) + row[s - row_lo:e - row_lo + 1] + [0] * (hi - e)
+
+def pruned_rows(a, b, match_cost, mismatch_cost, gap_cost, band=None, xdrop=None, kernel='python'):
+    '''
+    yield (i, row, lo, hi) for the rows of the local dp table of a and b, computing only columns lo..hi
+    of each row, which row holds, the others being 0.
+    with band, only the diagonals of band_diagonals are computed.
+    with xdrop, cells more than xdrop below the best score of the rows above drop to 0; once the best
+    score exceeds xdrop a row is computed only from the positive cells of the row above, extending right
+    while its cells stay alive, and rows stop when none is left
+    '''
+    if xdrop is not None:
+        assert gap_cost <= 0, "X-drop needs a gap cost of at most 0."
+    n = len(a)
+    m = len(b)
+    if band is not None:
+        dlo, dhi = band_diagonals(n, m, band)
+    if kernel == 'numpy':
+        assert np is not None, "numpy kernel needs numpy installed."
+        profile = query_profile(a, b, match_cost, mismatch_cost)
+        chain = np.arange(m + 1, dtype=np.int64) * gap_cost
+
+    best = 0
+    alive_lo, alive_hi = 1, m
+    prev, prev_lo = [], 1
+    for i in range(1, n + 1):
+        threshold = best - xdrop if xdrop is not None else 0
+        lo, hi = 1, m
+        if band is not None:
+            lo, hi = max(lo, i + dlo), min(hi, i + dhi)
+        if threshold > 0:
+            lo = max(lo, alive_lo)
+        # past column extend, only the cells to the left can keep a row alive
+        extend = alive_hi + 1 if threshold > 0 else hi
+
+        if kernel == 'numpy':
+            cur = np.zeros(0, dtype=np.int64)
+            scores = profile[a[i - 1]]
+            # past extend the row is computed in growing spans until a cell drops
+            span = min(hi, extend + XDROP_SPAN)
+            while lo <= hi:
+                p = row_window(prev, prev_lo, lo - 1, span, kernel)
+                e = p[1:] + gap_cost
+                np.maximum(e, p[:-1] + scores[lo - 1:span], out=e)
+                np.maximum(e, 0, out=e)
+                e -= chain[:span + 1 - lo]
+                np.maximum.accumulate(e, out=e)
+                e += chain[:span + 1 - lo]
+                # with a gap cost of at most 0 a dropped cell cannot lift the cells to its right
+                e[e < threshold] = 0
+                dead = np.flatnonzero(e[max(0, extend + 1 - lo):] == 0)
+                if threshold > 0 and len(dead):
+                    hi = max(lo, extend + 1) + int(dead[0]) - 1
+                elif span < hi:
+                    span = min(hi, 2 * span - lo + 1)
+                    continue
+                cur = e[:hi + 1 - lo]
+                break
+        else:
+            cur = []
+            x = a[i - 1]
+            # the row above is 0 past its last column
+            p = row_window(prev, prev_lo, lo - 1, min(hi, prev_lo + len(prev)), kernel)
+            width = len(p)
+            left = 0
+            for j in range(lo, hi + 1):
+                t = j - lo
+                h = max(0,
+                        (p[t + 1] if t + 1 < width else 0) + gap_cost,
+                        left + gap_cost,
+                        (p[t] if t < width else 0) + (match_cost if x == b[j - 1] else mismatch_cost))
+                if h < threshold:
+                    h = 0
+                if threshold > 0 and j > extend and h == 0:
+                    hi = j - 1
+                    break
+                cur.append(h)
+                left = h
+
+        yield i, cur, lo, hi
+        if len(cur):
+            best = max(best, max(cur) if kernel == 'python' else int(cur.max()))
+        prev, prev_lo = cur, lo
+
+        if xdrop is not None and best - xdrop > 0:
+            if kernel == 'numpy':
+                alive = np.flatnonzero(cur)
+            else:
+                alive = [t for t, h in enumerate(cur) if h > 0]
+            if not len(alive):
+                break
+            alive_lo, alive_hi = lo + int(alive[0]), lo + int(alive[-1])
+        else:
+            alive_lo, alive_hi = 1, m
+
+class PrunedRow:
+    '''
+    row of a dp table of width columns that holds only the columns from lo on in values, the others being 0
+    '''
+    __slots__ = ('lo', 'values', 'width')
+
+    def __init__(self, lo, values, width):
+        self.lo = lo
+        self.values = values
+        self.width = width
+
+    def __getitem__(self, j):
+        j -= self.lo
+        return self.values[j] if 0 <= j < len(self.values) else 0
+
+    def __iter__(self):
+        for j in range(self.width):
+            yield self[j]
+
+def pruned_matrices(a, b, match_cost, mismatch_cost, gap_cost, band=None, xdrop=None, kernel='python'):
+    '''
+    return H and T of smith_waterman and its best cells as lists besti and bestj from pruned_rows.
+    H and T are lists of PrunedRow holding only the computed columns of each row, so a band of width band
+    takes O(n * band) memory
+    '''
+    n = len(a)
+    m = len(b)
+    if kernel == 'numpy':
+        profile = query_profile(a, b, match_cost, mismatch_cost)
+    empty = PrunedRow(1, [], m + 1)
+    H = [empty] * (n + 1)
+    T = [empty] * (n + 1)
+
+    best, besti, bestj = 0, [], []
+    prev, prev_lo = [], 1
+    for i, row, lo, hi in pruned_rows(a, b, match_cost, mismatch_cost, gap_cost, band, xdrop, kernel):
+        if not len(row):
+            prev, prev_lo = row, lo
+            continue
+        H[i] = PrunedRow(lo, row, m + 1)
+        diag = row_window(prev, prev_lo, lo - 1, hi - 1, kernel)
+        if kernel == 'numpy':
+            left = np.concatenate(([0], row[:-1])) + gap_cost
+            T[i] = PrunedRow(lo, np.where(diag + profile[a[i - 1]][lo - 1:hi] == row, 2,
+                                          np.where(left == row, 1, 0)).astype(np.int8), m + 1)
+            top = int(row.max())
+        else:
+            x = a[i - 1]
+            t = []
+            for k, h in enumerate(row):
+                if diag[k] + (match_cost if x == b[lo + k - 1] else mismatch_cost) == h:
+                    t.append(2)
+                elif (row[k - 1] if k else 0) + gap_cost == h:
+                    t.append(1)
+                else:
+                    t.append(0)
+            T[i] = PrunedRow(lo, t, m + 1)
+            top = max(row)
+        prev, prev_lo = row, lo
+
+        if top >= best and top > 0:
+            js = [lo + j for j in find_all(row, top)]
+            if top > best:
+                best, besti, bestj = top, [], []
+            besti += [i] * len(js)
+            bestj += js
+
+    return H, T, besti, bestj
+
+def widen_band(a, b, match_cost, mismatch_cost, gap_cost, band=16, kernel='python'):
+    '''
+    return a band width for a and b, doubling band until the best score within it stops changing
+    or the band covers the whole dp table
+    '''
+    n = len(a)
+    m = len(b)
+    score = smith_waterman_score(a, b, match_cost, mismatch_cost, gap_cost, kernel, band, max_ends=0)[0]
+    while band < max(n, m):
+        wider = smith_waterman_score(a, b, match_cost, mismatch_cost, gap_cost, kernel, 2 * band, max_ends=0)[0]
+        if wider == score:
+            break
+        band, score = 2 * band, wider
+    return band
+
+def find_all(row, value):
+    '''
+    return the columns of row, a list or an array, holding value
+    '''
+    if isinstance(row, list):
+        return [j for j, h in enumerate(row) if h == value]
+    return np.flatnonzero(row == value).tolist()
+
+def smith_waterman_score(a, b, match_cost, mismatch_cost, gap_cost, kernel='python', band=None, xdrop=None,
+                         max_ends=None):
+    '''
+    return the best local alignment score of a and b and the cells (i, j) where it is reached,
+    keeping two rows of the dp table, restricted to a band or pruned by X-drop as in pruned_rows.
+    only the last max_ends of those cells are kept, none with max_ends 0 for the score alone
+    '''
+    # rows come with the column they start at
+    if band is not None or xdrop is not None:
+        rows = ((i, row, lo) for i, row, lo, hi in pruned_rows(a, b, match_cost, mismatch_cost, gap_cost, band, xdrop, kernel))
+    else:
+        rows = ((i, row, 0) for i, row in enumerate(score_rows(a, b, match_cost, mismatch_cost, gap_cost, True, kernel)))
+
+    # a bounded deque keeps the last cells, which are the ones traced back first
+    best, ends = 0, deque(maxlen=max_ends)
+    for i, row, lo in rows:
+        if not len(row):
+            continue
+        top = max(row) if kernel == 'python' else row.max()
+        if top > best:
+            best = top
+            ends.clear()
+        if top == best and top > 0 and max_ends != 0:
+            ends.extend((i, lo + j) for j in find_all(row, top))
+
+    return int(best), list(ends)
+
+def global_score_row(a, b, match_cost, mismatch_cost, gap_cost, kernel='python'):
+    '''
+    return the last row of the global alignment dp table of a and b, keeping two rows
+    '''
+    for row in score_rows(a, b, match_cost, mismatch_cost, gap_cost, False, kernel):
+        pass
+    return list(row)
+
+def local_start(a, b, i, j, best, match_cost, mismatch_cost, gap_cost, kernel='python'):
+    '''
+    return the shortest start (p, q) of a local alignment of score best ending at cell (i, j),
+    scoring alignments anchored at (i, j) backwards one row at a time
+    '''
+    for p, row in enumerate(score_rows(a[:i][::-1], b[:j][::-1], match_cost, mismatch_cost, gap_cost, False, kernel)):
+        found = find_all(row, best)
+        if found:
+            return i - p, j - found[0]
+    return 0, 0
+
+def hirschberg(a, b, match_cost, mismatch_cost, gap_cost, kernel='python'):
+    '''
+    return a best global alignment of a and b as two gapped strings, by divide and conquer in linear space
+    '''
+    n = len(a)
+    m = len(b)
+    if n == 0 or m == 0:
+        return a + '_' * m, '_' * n + b
+    if n == 1:
+        # the base either faces its best column or stands next to a gap
+        j = max(range(m), key=lambda j: (match_cost if a == b[j] else mismatch_cost, -j))
+        if (match_cost if a == b[j] else mismatch_cost) >= 2 * gap_cost:
+            return '_' * j + a + '_' * (m - j - 1), b
+        return a + '_' * m, '_' + b
+
+    mid = n // 2
+    left = global_score_row(a[:mid], b, match_cost, mismatch_cost, gap_cost, kernel)
+    right = global_score_row(a[mid:][::-1], b[::-1], match_cost, mismatch_cost, gap_cost, kernel)
+    split = max(range(m + 1), key=lambda j: (left[j] + right[m - j], -j))
+
+    aligned_a1, aligned_b1 = hirschberg(a[:mid], b[:split], match_cost, mismatch_cost, gap_cost, kernel)
+    aligned_a2, aligned_b2 = hirschberg(a[mid:], b[split:], match_cost, mismatch_cost, gap_cost, kernel)
+    return aligned_a1 + aligned_a2, aligned_b1 + aligned_b2
+
+def linear_alignments(a, b, match_cost, mismatch_cost, gap_cost, kernel='python', max_ties=None):
+    '''
+    return the best local alignments of a and b formatted like smith_waterman, in linear memory:
+    the best cells come from smith_waterman_score, the start of each from local_start
+    and the alignment in between from hirschberg. only the last max_ties cells are traced back
+    '''
+    best, ends = smith_waterman_score(a, b, match_cost, mismatch_cost, gap_cost, kernel, max_ends=max_ties)
+
+    ret_align = ""
+    while ends:
+        i, j = ends.pop()
+        p, q = local_start(a, b, i, j, best, match_cost, mismatch_cost, gap_cost, kernel)
+        aligned_a, aligned_b = hirschberg(a[p:i], b[q:j], match_cost, mismatch_cost, gap_cost, kernel)
+        ret_align += "pos " + str(q) + "\n" + aligned_a + "\n" + aligned_b + "\n"
+    return ret_align
 
 def is_intstring(s):
     try:
@@ -107,40 +647,77 @@ def is_intstring(s):
     except ValueError:
         return False
 
-first_string = sys.argv[1]
-second_string = sys.argv[2]
-match_cost = sys.argv[3]
-mismatch_cost = sys.argv[4]
-gap_cost = sys.argv[5]
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description='Smith-Waterman local alignment.')
+    parser.add_argument('first_string')
+    parser.add_argument('second_string')
+    parser.add_argument('match_cost')
+    parser.add_argument('mismatch_cost')
+    parser.add_argument('gap_cost')
+    parser.add_argument('--no-dp-table', action='store_true', help='do not write dp_table.txt')
+    parser.add_argument('--linear-space', action='store_true',
+                        help='recover alignments in linear memory, without dp_table.txt')
+    parser.add_argument('--score-only', action='store_true',
+                        help='print the best score in linear memory instead of writing alignments')
+    parser.add_argument('--kernel', choices=['python', 'numpy'], default='python',
+                        help='fill the dp table cell by cell in Python or a row at a time with numpy')
+    parser.add_argument('--band', type=int, help='fill only diagonals within BAND of the main diagonals')
+    parser.add_argument('--widen-band', action='store_true',
+                        help='double the band, from --band or ' + str(BAND_START) + ', until the best score is stable')
+    parser.add_argument('--xdrop', type=int, help='drop cells scoring more than XDROP below the best score')
+    parser.add_argument('--top', type=int, help='report up to TOP non-overlapping alignments, best first')
+    parser.add_argument('--max-ties', type=int, help='report at most MAX_TIES alignments of the same score')
+    args = parser.parse_args()
 
-assert isinstance(first_string, str), "first_string is not string."
-assert isinstance(second_string, str), "second_string is not string."
-assert is_intstring(match_cost), "match_cost is not integer."
-assert is_intstring(mismatch_cost), "mismatch_cost is not integer."
-assert is_intstring(gap_cost), "gap_cost is not integer."
+    first_string = args.first_string
+    second_string = args.second_string
+    match_cost = args.match_cost
+    mismatch_cost = args.mismatch_cost
+    gap_cost = args.gap_cost
 
-match_cost = int(match_cost)
-mismatch_cost = int(mismatch_cost)
-gap_cost = int(gap_cost)
+    assert isinstance(first_string, str), "first_string is not string."
+    assert isinstance(second_string, str), "second_string is not string."
+    assert is_intstring(match_cost), "match_cost is not integer."
+    assert is_intstring(mismatch_cost), "mismatch_cost is not integer."
+    assert is_intstring(gap_cost), "gap_cost is not integer."
 
-for i in first_string:
-    assert i in ['A','T','G','C'], "Strings should consist of A,T,G and C. Your string has " + i + "."
-for i in second_string:
-    assert i in ['A','T','G','C'], "Strings should consist of A,T,G and C. Your string has " + i + "."
+    match_cost = int(match_cost)
+    mismatch_cost = int(mismatch_cost)
+    gap_cost = int(gap_cost)
 
-if match_cost < mismatch_cost or match_cost < gap_cost:
-    print("Generally, match cost is bigger than mismatch cost and gap cost. Are you sure with these costs?")
+    for i in first_string:
+        assert i in ['A','T','G','C'], "Strings should consist of A,T,G and C. Your string has " + i + "."
+    for i in second_string:
+        assert i in ['A','T','G','C'], "Strings should consist of A,T,G and C. Your string has " + i + "."
 
-output_dp_table = open("dp_table.txt", "w")
-output_alignment = open("alignment.txt", "w")
+    if match_cost < mismatch_cost or match_cost < gap_cost:
+        print("Generally, match cost is bigger than mismatch cost and gap cost. Are you sure with these costs?")
 
-dp_table, alignment = smith_waterman(first_string, second_string, match_cost, mismatch_cost, gap_cost)
+    if args.top is not None and (args.band is not None or args.widen_band or args.xdrop is not None or args.linear_space):
+        parser.error("--top needs the full, unpruned matrix, without --band, --widen-band, --xdrop or --linear-space")
 
-if not alignment:
-    output_alignment.write("No valid alignment")
+    if args.score_only:
+        band = args.band
+        if args.widen_band:
+            band = widen_band(first_string, second_string, match_cost, mismatch_cost, gap_cost,
+                              BAND_START if band is None else band, args.kernel)
+        best, ends = smith_waterman_score(first_string, second_string, match_cost, mismatch_cost, gap_cost,
+                                          args.kernel, band, args.xdrop, max_ends=0)
+        print(best)
+    else:
+        write_dp_table = not (args.no_dp_table or args.linear_space)
+        dp_table, alignment = smith_waterman(first_string, second_string, match_cost, mismatch_cost, gap_cost,
+                                             write_dp_table, args.linear_space, args.kernel,
+                                             args.band, args.xdrop, args.widen_band, args.top, args.max_ties)
 
-output_dp_table.write(dp_table)
-output_alignment.write(alignment)
+        output_alignment = open("alignment.txt", "w")
+        if not alignment:
+            output_alignment.write("No valid alignment")
+        output_alignment.write(alignment)
+        output_alignment.close()
 
-output_dp_table.close()
-output_alignment.close()
\ No newline at end of file
+        if write_dp_table:
+            output_dp_table = open("dp_table.txt", "w")
+            output_dp_table.write(dp_table)
+            output_dp_table.close()
@@ -0,0 +1,166 @@
+import argparse
+import heapq
+import os.path
+from multiprocessing import Pool
+
+from Smith_waterman_algo import hirschberg, is_intstring, local_start, smith_waterman_score
+
+# targets scored per task of the pool
+BATCH_SIZE = 64
+
+def read_fasta(f):
+    '''
+    yield (name, sequence) of each record of FASTA file f, joining multi-line sequences
+    '''
+    name = None
+    lines = []
+    for line in f:
+        line = line.strip()
+        if line.startswith('>'):
+            if name is not None:
+                yield name, ''.join(lines)
+            name = line[1:].split()[0] if line[1:].strip() else ''
+            lines = []
+        elif line:
+            assert name is not None, "Database should be a FASTA file starting with a '>' line."
+            lines.append(line.upper())
+    if name is not None:
+        yield name, ''.join(lines)
+
+def batches(records, size):
+    '''
+    yield (index of the first record, list of records) of consecutive records, size at a time
+    '''
+    batch = []
+    start = 0
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield start, batch
+            start += size
+            batch = []
+    if batch:
+        yield start, batch
+
+def init_search_worker(query, match_cost, mismatch_cost, gap_cost, kernel, top):
+    global search_query, search_costs, search_kernel, search_top
+    search_query = query
+    search_costs = (match_cost, mismatch_cost, gap_cost)
+    search_kernel = kernel
+    search_top = top
+
+def score_batch(task):
+    '''
+    return (name, length, score) of the best local alignment of the query against every target of a batch,
+    and the batch's top candidates as (score, -index, name, sequence) so only they travel back with sequences
+    '''
+    start, batch = task
+    scores = []
+    candidates = []
+    for i, (name, seq) in enumerate(batch, start):
+        score = smith_waterman_score(search_query, seq, *search_costs, kernel=search_kernel, max_ends=0)[0]
+        scores.append((name, len(seq), score))
+        if score > 0:
+            candidate = (score, -i, name, seq)
+            if len(candidates) < search_top:
+                heapq.heappush(candidates, candidate)
+            elif candidate > candidates[0]:
+                heapq.heapreplace(candidates, candidate)
+    return scores, candidates
+
+def best_alignment(a, b, match_cost, mismatch_cost, gap_cost, kernel='python'):
+    '''
+    return (score, start and end in a, start and end in b, aligned a, aligned b) of one best local alignment,
+    ending at the cell smith_waterman reports first, recovered in linear memory
+    '''
+    best, ends = smith_waterman_score(a, b, match_cost, mismatch_cost, gap_cost, kernel, max_ends=1)
+    if not ends:
+        return best, 0, 0, 0, 0, '', ''
+    i, j = ends[-1]
+    p, q = local_start(a, b, i, j, best, match_cost, mismatch_cost, gap_cost, kernel)
+    aligned_a, aligned_b = hirschberg(a[p:i], b[q:j], match_cost, mismatch_cost, gap_cost, kernel)
+    return best, p, i, q, j, aligned_a, aligned_b
+
+def search(query, targets, match_cost, mismatch_cost, gap_cost, top=10, workers=1, kernel='python',
+           scores_f=None, batch_size=BATCH_SIZE):
+    '''
+    score query against every (name, sequence) of targets and return the top hits, best first,
+    as (name, best_alignment) with the traceback run only for them.
+    the score of each target is streamed to scores_f as "name<TAB>length<TAB>score" lines in target order.
+    '''
+    initargs = (query, match_cost, mismatch_cost, gap_cost, kernel, top)
+    tasks = batches(targets, batch_size)
+    if workers > 1:
+        pool = Pool(workers, init_search_worker, initargs)
+        results = pool.imap(score_batch, tasks)
+    else:
+        pool = None
+        init_search_worker(*initargs)
+        results = map(score_batch, tasks)
+
+    # batches come back in order, so scores are written in target order as they arrive
+    hits = []
+    for scores, candidates in results:
+        for candidate in candidates:
+            if len(hits) < top:
+                heapq.heappush(hits, candidate)
+            elif candidate > hits[0]:
+                heapq.heapreplace(hits, candidate)
+        if scores_f is not None:
+            scores_f.write(''.join(name + '\t' + str(length) + '\t' + str(score) + '\n'
+                                   for name, length, score in scores))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return [(name, best_alignment(query, seq, match_cost, mismatch_cost, gap_cost, kernel))
+            for score, i, name, seq in sorted(hits, reverse=True)]
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description='Smith-Waterman search of one query against a FASTA database.')
+    parser.add_argument('query')
+    parser.add_argument('database')
+    parser.add_argument('match_cost')
+    parser.add_argument('mismatch_cost')
+    parser.add_argument('gap_cost')
+    parser.add_argument('--top', type=int, default=10, help='best hits aligned and written to search_hits.tsv')
+    parser.add_argument('--workers', type=int, default=1, help='processes scoring the database')
+    parser.add_argument('--kernel', choices=['python', 'numpy'], default='python',
+                        help='fill the dp table cell by cell in Python or a row at a time with numpy')
+    args = parser.parse_args()
+
+    query = args.query
+    match_cost = args.match_cost
+    mismatch_cost = args.mismatch_cost
+    gap_cost = args.gap_cost
+
+    assert os.path.isfile(args.database), "database file does not exist."
+    assert is_intstring(match_cost), "match_cost is not integer."
+    assert is_intstring(mismatch_cost), "mismatch_cost is not integer."
+    assert is_intstring(gap_cost), "gap_cost is not integer."
+    assert args.top > 0, "top should be positive."
+
+    match_cost = int(match_cost)
+    mismatch_cost = int(mismatch_cost)
+    gap_cost = int(gap_cost)
+
+    for i in query:
+        assert i in ['A','T','G','C'], "Query should consist of A,T,G and C. Your query has " + i + "."
+
+    database_f = open(args.database, "r")
+    output_scores = open("search_scores.tsv", "w")
+    output_scores.write("target\tlength\tscore\n")
+
+    hits = search(query, read_fasta(database_f), match_cost, mismatch_cost, gap_cost, args.top, args.workers,
+                  args.kernel, output_scores)
+
+    database_f.close()
+    output_scores.close()
+
+    output_hits = open("search_hits.tsv", "w")
+    output_hits.write("rank\ttarget\tscore\tquery_start\tquery_end\ttarget_start\ttarget_end\taligned_query\taligned_target\n")
+    for rank, (name, alignment) in enumerate(hits, 1):
+        output_hits.write(str(rank) + "\t" + name + "\t" + "\t".join(str(x) for x in alignment) + "\n")
+    output_hits.close()